@@ -0,0 +1,56 @@
+#version 330 core
+
+uniform mat4 model;
+uniform mat4 view;
+uniform mat4 projection;
+
+// heightfield spread over [extent_low, extent_high] in model space
+uniform sampler2D heightmap;
+uniform sampler2D normalmap;
+uniform vec2 extent_low;
+uniform vec2 extent_high;
+// tex coords = position.xy * tex_transform.xy + tex_transform.zw
+uniform vec4 tex_transform;
+
+// flat grid over [0, 1]^2 shared by every heightmap mesh
+layout(location = 0) in vec2 grid;
+
+// Texture
+out vec2 frag_tex_coords;
+out float dirt_coef;
+out float mix_coef;
+
+// Light
+out vec3 out_normal;
+out vec3 frag_pos;
+out vec4 view_space;
+
+void main() {
+    // sample texel centers, grid corners land on the border heights
+    vec2 size = vec2(textureSize(heightmap, 0));
+    vec2 texel = (grid * (size - 1) + 0.5) / size;
+    vec3 position = vec3(mix(extent_low, extent_high, grid),
+                         textureLod(heightmap, texel, 0).r);
+    vec3 normal = textureLod(normalmap, texel, 0).xyz;
+
+    frag_tex_coords = position.xy * tex_transform.xy + tex_transform.zw;
+    mix_coef = 1;
+    // Compute mix_coef between basalte and grass
+    if(position.z > 6) {
+        mix_coef = normal.z;
+    }
+
+    // Compute dirt_coef
+    if(position.z < 4) {
+        dirt_coef = 1;
+    } else if(position.z > 6) {
+        dirt_coef = 0;
+    } else {
+        dirt_coef = -0.5 * position.z + 3;
+    }
+
+    out_normal = mat3(transpose(inverse(model))) * normal;
+    frag_pos = vec3(model * vec4(position, 1.0));
+    view_space = view * vec4(frag_pos, 1);
+    gl_Position = projection * view_space;
+}
@@ -1,72 +1,58 @@
 """ Volcano object """
 
-import math as Math
+from functools import partial
 
 import numpy as np
 from OpenGL import GL
-from perlin_noise import PerlinNoise
 
 from core import Mesh
+from heightfield import Heightfield
+from heightmap import HeightmapMesh
+from heights import VOLCANO_NOISES, cone
+from mesh_cache import mesh_cache
 from texture import Texture, Textured
 from transform import compute_normals, create_grid
-
-noise1 = PerlinNoise(octaves=3, seed=3)
-noise2 = PerlinNoise(octaves=6, seed=2)
-
-
-def get_altitude(x, y, puissance, taille):
-    """Returns the altitude computed with perlin noise"""
-    if (
-        x - taille >= taille - 1
-        or y - taille >= taille - 1
-        or x - taille <= -taille + 1
-        or y - taille <= -taille + 1
-    ):
-        return 0
-    nx = x / 100
-    ny = y / 100
-    out = 4 * noise1([nx, ny])
-    out += 3 * noise2([nx, ny])
-    if out <= 0:
-        return out
-    return Math.pow(out, puissance)
-
-
-def smooth(points, size):
-    """Applique une fonction de lissage sur un ensemble de points 3D."""
-    for i in range(2 * size + 1, len(points) - (2 * size + 1)):
-        if i % (2 * size + 1) == 0:
-            continue
-        if i % (2 * size + 1) == 2 * size:
-            continue
-
-        voisins_directs = 2 * np.array(
-            [
-                2 * points[i],
-                points[i - 1],
-                points[i + 1],
-                points[i + (2 * size + 1)],
-                points[i - (2 * size + 1)],
-            ]
-        )
-        voisins_diagonale = np.array(
-            [
-                points[i - (2 * size)],
-                points[i - (2 * size + 2)],
-                points[i + (2 * size)],
-                points[i + (2 * size + 2)],
-            ]
-        )
-
-        points[i] = (
-            np.sum(np.concatenate((voisins_diagonale, voisins_directs)), axis=0) / 16
-        )
+from vertex_cache import optimize as optimize_vertex_cache
+
+
+# smoothing kernels, weights of the neighbors of a vertex summing to 1
+BINOMIAL_3 = np.outer((1, 2, 1), (1, 2, 1)) / 16
+GAUSSIAN_5 = np.outer((1, 4, 6, 4, 1), (1, 4, 6, 4, 1)) / 256
+
+
+def smooth(points, size, iterations=1, kernel=BINOMIAL_3, mask=None):
+    """Smooth the heights of a (2 size + 1)^2 grid of points in place by
+    convolving them iterations times with a square kernel of odd size 3 or
+    more. Vertices nearer to the border than the kernel radius, or False in
+    the optional mask, keep their height. Each pass only reads the previous
+    one, so that the result does not depend on the vertex order."""
+    count = 2 * size + 1
+    kernel = np.asarray(kernel, np.float64)
+    if kernel.ndim != 2 or kernel.shape[0] != kernel.shape[1]:
+        raise ValueError("square smoothing kernel expected")
+    if len(kernel) < 3 or len(kernel) % 2 == 0 or len(kernel) > count:
+        raise ValueError("kernel size expected odd, at least 3, within the grid")
+    radius = len(kernel) // 2
+    inner = count - 2 * radius
+    heights = points[:, 2].reshape(count, count).copy()
+    if mask is not None:
+        mask = np.reshape(mask, (count, count))[radius:-radius, radius:-radius]
+    for _ in range(iterations):
+        total = np.zeros((inner, inner))
+        for (i, j), weight in np.ndenumerate(kernel):
+            if weight:
+                total += weight * heights[i : i + inner, j : j + inner]
+        center = heights[radius:-radius, radius:-radius]
+        center[...] = total if mask is None else np.where(mask, total, center)
+    points[:, 2] = heights.ravel()
 
 
 class Volcano(Textured):
     """Simple first textured object"""
 
-    def __init__(self, shader, tex_file, tex_file2):
+    def __init__(
+        self, shader, tex_file, tex_file2, heightmap_shader=None, workers=1
+    ):
         self.taille = 80
 
         self.wrap = GL.GL_REPEAT
@@ -74,33 +60,74 @@ class Volcano(Textured):
         self.file = tex_file
         self.file2 = tex_file2
 
-        def formula(x_pos, y_pos):
-            distance = 0.4 * (np.sqrt(y_pos**2 + x_pos**2)) ** 2
-            return 5000 * distance / (1500 + distance**2) + 2 * get_altitude(
-                x_pos + self.taille, y_pos + self.taille, 0.01, self.taille
-            )
+        # module level formula, so that worker processes can unpickle it
+        formula = partial(cone, taille=self.taille)
 
-        base_coords, indices = create_grid(self.taille, formula=formula)
-        base_coords = 2.5 * base_coords
-        smooth(base_coords, self.taille)
-
-        normal = compute_normals(base_coords, indices)
+        def build_mesh():
+            base_coords, indices = create_grid(
+                self.taille, formula=formula, workers=workers
+            )
+            base_coords = 2.5 * base_coords
+            smooth(base_coords, self.taille)
+            normals = compute_normals(base_coords, indices)
+            count = 2 * self.taille + 1
+            # reordered for the vertex cache once here, rather than at each upload
+            attributes, indices = optimize_vertex_cache(
+                dict(
+                    position=base_coords.astype(np.float32),
+                    normal=normals,
+                    tex_coord=np.float32(
+                        (base_coords[:, :2] + self.taille) / (2 * self.taille)
+                    ),
+                ),
+                indices,
+            )
+            # grid heights and normals, indexed [x, y], for the heightmap mode
+            return dict(
+                attributes,
+                index=indices,
+                heights=base_coords[:, 2].reshape(count, count).astype(np.float32),
+                grid_normal=normals.reshape(count, count, 3),
+            )
 
-        mesh = Mesh(
-            shader,
-            attributes={
-                "position": base_coords,
-                "normal": normal,
-                "tex_coord": [
-                    (
-                        (base_coords[i][0] + self.taille) / (2 * self.taille),
-                        (base_coords[i][1] + self.taille) / (2 * self.taille),
-                    )
-                    for i in range(len(base_coords))
-                ],
-            },
-            index=indices,
+        # terrain arrays are generated once, then memory mapped from the cache
+        params = dict(
+            taille=self.taille,
+            formula=formula,
+            noise=[(n.octaves, n.seed) for n in VOLCANO_NOISES],
         )
+        arrays = mesh_cache.get("volcano", params, build_mesh)
+        half = 2.5 * self.taille
+        heights = arrays["heights"]
+        # ground height queries, in mesh coordinates
+        self.heightfield = Heightfield(heights, (-half, -half), (half, half))
+        if heightmap_shader is None:
+            mesh = Mesh(
+                shader,
+                attributes={
+                    "position": arrays["position"],
+                    "normal": arrays["normal"],
+                    "tex_coord": arrays["tex_coord"],
+                },
+                index=arrays["index"],
+                interleaved=True,
+                formats=dict(normal="normal", tex_coord="half"),
+            )
+        else:
+            # same grid, displaced on the GPU from its heights and normals
+            mesh = HeightmapMesh(
+                heightmap_shader,
+                heights,
+                (-half, -half),
+                (half, half),
+                arrays["grid_normal"],
+                tex_transform=(
+                    1 / (2 * self.taille),
+                    1 / (2 * self.taille),
+                    0.5,
+                    0.5,
+                ),
+            )
 
         # setup & upload texture to GPU, bind it to shader name 'diffuse_map'
         texture = Texture(tex_file, self.wrap, *self.filter)
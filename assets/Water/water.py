@@ -1,10 +1,13 @@
 """ Water object """
 
+import numpy as np
 from OpenGL import GL
 
 from core import Mesh
+from mesh_cache import mesh_cache
 from texture import Texture, Textured
 from transform import compute_normals, create_grid
+from vertex_cache import optimize as optimize_vertex_cache
 
 
 class Water(Textured):
@@ -14,25 +17,34 @@ class Water(Textured):
         # setup plane mesh to be textured
         self.taille = 75
         self.scale = 15
+        self.seed = 10
         self.shader = shader
         self.tex = Texture("img/water.jpg", GL.GL_REPEAT, GL.GL_NEAREST, GL.GL_NEAREST)
 
-        self.positions, self.indices = create_grid(self.taille, True, -40)
-        self.positions = self.positions * self.scale
-        self.normal = compute_normals(self.positions, self.indices)
+        def build_mesh():
+            positions, indices = create_grid(self.taille, True, -40, seed=self.seed)
+            positions = positions * self.scale
+            extent = self.scale * self.taille
+            attributes, indices = optimize_vertex_cache(
+                dict(
+                    position=positions.astype(np.float32),
+                    tex_coord=np.float32((positions[:, :2] + extent) / (2 * extent)),
+                    normal=compute_normals(positions, indices),
+                ),
+                indices,
+            )
+            return dict(attributes, index=indices)
+
+        # plane arrays are generated once, then memory mapped from the cache
+        params = dict(taille=self.taille, scale=self.scale, seed=self.seed)
+        arrays = mesh_cache.get("water", params, build_mesh)
+        self.positions, self.indices = arrays["position"], arrays["index"]
+        self.normal = arrays["normal"]
         self.mesh = Mesh(
             shader,
             attributes={
                 "position": self.positions,
-                "tex_coord": [
-                    (
-                        (self.positions[i][0] + self.scale * self.taille)
-                        / (2 * self.scale * self.taille),
-                        (self.positions[i][1] + self.scale * self.taille)
-                        / (2 * self.scale * self.taille),
-                    )
-                    for i in range(len(self.positions))
-                ],
+                "tex_coord": arrays["tex_coord"],
                 "normal": self.normal,
             },
             index=self.indices,
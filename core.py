@@ -2,9 +2,13 @@
 
 # Python built-in modules
 import atexit
+import bisect  # prefix lookups in sorted file names
+import ctypes  # attribute offsets in interleaved buffers
 import os  # os function, i.e. checking file status
 import sys
 import time  # launch a function at exit
+import weakref  # shared shader programs live as long as their users
+from collections import deque  # recent updates of ring buffers
 from itertools import cycle  # allows easy circular choice list
 
 import assimpcy  # 3D resource loader
@@ -15,25 +19,67 @@ import OpenGL.GL as GL  # standard Python OpenGL wrapper
 
 from camera import (CAMERA_NORMAL_MOVE, CAMERA_PAN_MOVE, CAMERA_ROTATE_MOVE,
                     Camera)
+import scene_cache
+from program_cache import program_cache
 # our transform functions
-from transform import identity
+from transform import compact_index_type, identity
+from vertex_cache import optimize as optimize_vertex_cache
+from vertex_format import COMPACT, report, vertex_format
 
 # initialize and automatically terminate glfw on exit
 glfw.init()
 atexit.register(glfw.terminate)
 
 
+# optional KHR_parallel_shader_compile entry point, missing in older PyOpenGL
+try:
+    from OpenGL.GL.KHR.parallel_shader_compile import glMaxShaderCompilerThreadsKHR
+except ImportError:
+    glMaxShaderCompilerThreadsKHR = None
+PARALLEL_COMPILE = b"GL_KHR_parallel_shader_compile"
+# program binaries are core in GL 4.1, an extension before
+PROGRAM_BINARY = b"GL_ARB_get_program_binary"
+
+# buffers updated at run time, orphaned by default instead of written in place
+STREAMED_USAGES = (GL.GL_DYNAMIC_DRAW, GL.GL_STREAM_DRAW)
+# ring buffers, updated every frame without stalling on pending draws
+RING_REGIONS = 3  # frames a ring buffer can be ahead of the GPU
+FENCE_TIMEOUT = 1_000_000_000  # longest wait for a ring region, in ns
+
+
 # ------------ low level OpenGL object wrappers ----------------------------
 class Shader:
-    """Helper class to create and automatically destroy shader program"""
+    """Helper class to create and automatically destroy shader program.
+    Programs are shared: building a Shader from the same sources and defines
+    as a live one returns that one, the program is destroyed with its last
+    user."""
+
+    programs = weakref.WeakValueDictionary()  # live programs by source key
+    driver = None  # GL vendor, renderer and version, read with the first one
+    binaries = False  # whether the driver can save and load program binaries
 
     @staticmethod
-    def _compile_shader(src, shader_type):
+    def _read(src, defines=None):
+        """Source text of a file name or raw string, with #define lines"""
         src = open(src, "r", encoding="UTF-8").read() if os.path.exists(src) else src
         src = src.decode("ascii") if isinstance(src, bytes) else src
+        if defines:
+            lines = src.splitlines(keepends=True)
+            head = 1 if lines and lines[0].startswith("#version") else 0
+            macros = ["#define %s %s\n" % item for item in sorted(defines.items())]
+            src = "".join(lines[:head] + macros + lines[head:])
+        return src
+
+    @staticmethod
+    def _compile_shader(src, shader_type):
+        """Submit src for compilation, its status is checked once needed"""
         shader = GL.glCreateShader(shader_type)
         GL.glShaderSource(shader, src)
         GL.glCompileShader(shader)
+        return shader
+
+    @staticmethod
+    def _check_shader(shader, src, shader_type):
         status = GL.glGetShaderiv(shader, GL.GL_COMPILE_STATUS)
         src = ("%3d: %s" % (i + 1, l) for i, l in enumerate(src.splitlines()))
         if not status:
@@ -42,49 +88,149 @@ class Shader:
             src = "\n".join(src)
             print("Compile failed for %s\n%s\n%s" % (shader_type, log, src))
             sys.exit(1)
-        return shader
 
-    def __init__(self, vertex_source, fragment_source, debug=False):
-        """Shader can be initialized with raw strings or source file names"""
-        vert = self._compile_shader(vertex_source, GL.GL_VERTEX_SHADER)
-        frag = self._compile_shader(fragment_source, GL.GL_FRAGMENT_SHADER)
-        if vert and frag:
-            self.glid = GL.glCreateProgram()  # pylint: disable=E1111
-            GL.glAttachShader(self.glid, vert)
-            GL.glAttachShader(self.glid, frag)
-            GL.glLinkProgram(self.glid)
-            GL.glDeleteShader(vert)
-            GL.glDeleteShader(frag)
-            status = GL.glGetProgramiv(self.glid, GL.GL_LINK_STATUS)
-            if not status:
-                print(GL.glGetProgramInfoLog(self.glid).decode("ascii"))
-                os._exit(1)
+    @classmethod
+    def _driver(cls):
+        """GL vendor, renderer and version strings, parallel compile and
+        program binary support"""
+        if cls.driver is None:
+            cls.driver = tuple(
+                GL.glGetString(name) or b""
+                for name in (GL.GL_VENDOR, GL.GL_RENDERER, GL.GL_VERSION)
+            )
+            extensions = {
+                GL.glGetStringi(GL.GL_EXTENSIONS, i)
+                for i in range(GL.glGetIntegerv(GL.GL_NUM_EXTENSIONS))
+            }
+            if glMaxShaderCompilerThreadsKHR is not None and (
+                PARALLEL_COMPILE in extensions
+            ):
+                glMaxShaderCompilerThreadsKHR(0xFFFFFFFF)  # driver's choice
+            version = (
+                GL.glGetIntegerv(GL.GL_MAJOR_VERSION),
+                GL.glGetIntegerv(GL.GL_MINOR_VERSION),
+            )
+            if PROGRAM_BINARY in extensions or version >= (4, 1):
+                formats = GL.glGetIntegerv(GL.GL_NUM_PROGRAM_BINARY_FORMATS)
+                cls.binaries = formats > 0
+        return cls.driver
+
+    def __new__(cls, vertex_source, fragment_source, debug=False, defines=None):
+        key = (cls._read(vertex_source, defines), cls._read(fragment_source, defines))
+        shader = cls.programs.get(key)
+        if shader is None:
+            shader = super().__new__(cls)
+            shader.key = key
+            cls.programs[key] = shader
+        return shader
 
-        # get location, size & type for uniform variables using GL introspection
-        self.uniforms = {}
+    def __init__(self, vertex_source, fragment_source, debug=False, defines=None):
+        """Shader can be initialized with raw strings or source file names,
+        defines maps macro names to values inserted after #version.
+        The program comes from the binary cache when the driver accepts it,
+        else it is compiled and linked in the background: its status is only
+        queried on first use of glid or by finish_all, so that programs
+        created in a row compile in parallel."""
+        if hasattr(self, "program"):
+            return  # shared program, already submitted
         self.debug = debug
+        self.uniforms = {}
+        self.pending = None  # shaders compiling, until checked in finish()
+        self.cache_key = program_cache.key(self.key, self._driver())
+        self.program = GL.glCreateProgram()  # pylint: disable=E1111
+        if self.binaries and self._load_binary():
+            self._introspect()
+            return
+        vert = self._compile_shader(self.key[0], GL.GL_VERTEX_SHADER)
+        frag = self._compile_shader(self.key[1], GL.GL_FRAGMENT_SHADER)
+        GL.glAttachShader(self.program, vert)
+        GL.glAttachShader(self.program, frag)
+        if self.binaries:
+            GL.glProgramParameteri(
+                self.program, GL.GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL.GL_TRUE
+            )
+        GL.glLinkProgram(self.program)
+        self.pending = (vert, frag)
+
+    def _load_binary(self):
+        """Load the cached program binary, False if missing or rejected"""
+        cached = program_cache.load(self.cache_key)
+        if cached is None:
+            return False
+        binary_format, binary = cached
+        binary = np.frombuffer(binary, np.uint8)
+        try:
+            GL.glProgramBinary(self.program, binary_format, binary, binary.size)
+            if GL.glGetProgramiv(self.program, GL.GL_LINK_STATUS):
+                return True
+        except GL.GLError:  # binary format no longer supported
+            pass
+        # driver update or mismatch: compile from sources again
+        program_cache.invalidate(self.cache_key)
+        GL.glDeleteProgram(self.program)
+        self.program = GL.glCreateProgram()  # pylint: disable=E1111
+        return False
+
+    def finish(self):
+        """Check compile and link status of a submitted program, then read its
+        uniforms and save its binary"""
+        if self.pending is None:
+            return
+        vert, frag = self.pending
+        self.pending = None
+        self._check_shader(vert, self.key[0], GL.GL_VERTEX_SHADER)
+        self._check_shader(frag, self.key[1], GL.GL_FRAGMENT_SHADER)
+        GL.glDeleteShader(vert)
+        GL.glDeleteShader(frag)
+        status = GL.glGetProgramiv(self.program, GL.GL_LINK_STATUS)
+        if not status:
+            print(GL.glGetProgramInfoLog(self.program).decode("ascii"))
+            os._exit(1)
+        self._introspect()
+        if self.binaries:
+            self._save_binary()
+
+    def _save_binary(self):
+        """Store the linked program binary, if the driver can provide it"""
+        size = GL.glGetProgramiv(self.program, GL.GL_PROGRAM_BINARY_LENGTH)
+        if not size:
+            return
+        binary = np.empty(size, np.uint8)
+        length, binary_format = np.zeros(1, np.int32), np.zeros(1, np.uint32)
+        GL.glGetProgramBinary(self.program, size, length, binary_format, binary)
+        program_cache.store(self.cache_key, int(binary_format[0]), binary[: length[0]])
+
+    @property
+    def glid(self):
+        """GL program name, once compiled, linked and checked"""
+        self.finish()
+        return self.program
+
+    def _introspect(self):
+        # get location, size & type for uniform variables using GL introspection
         get_name = {int(k): str(k).split()[0] for k in self.GL_SETTERS.keys()}
-        for var in range(GL.glGetProgramiv(self.glid, GL.GL_ACTIVE_UNIFORMS)):
-            name, size, type_ = GL.glGetActiveUniform(self.glid, var)
+        for var in range(GL.glGetProgramiv(self.program, GL.GL_ACTIVE_UNIFORMS)):
+            name, size, type_ = GL.glGetActiveUniform(self.program, var)
             # remove array characterization
             name = name.decode().split("[")[0]
-            args = [GL.glGetUniformLocation(self.glid, name), size]
+            args = [GL.glGetUniformLocation(self.program, name), size]
             # add transpose=True as argument for matrix types
             if type_ in {GL.GL_FLOAT_MAT2, GL.GL_FLOAT_MAT3, GL.GL_FLOAT_MAT4}:
                 args.append(True)
-            if debug:
+            if self.debug:
                 call = self.GL_SETTERS[type_].__name__
                 print(f"uniform {get_name[type_]} {name}: {call}{tuple(args)}")
             self.uniforms[name] = (self.GL_SETTERS[type_], args)
 
     def set_uniforms(self, uniforms):
         """set only uniform variables that are known to shader"""
+        self.finish()
         for name in uniforms.keys() & self.uniforms.keys():
             set_uniform, args = self.uniforms[name]
             set_uniform(*args, uniforms[name])
 
     def __del__(self):
-        GL.glDeleteProgram(self.glid)  # object dies => destroy GL object
+        GL.glDeleteProgram(self.program)  # object dies => destroy GL object
 
     GL_SETTERS = {
         GL.GL_UNSIGNED_INT: GL.glUniform1uiv,
@@ -109,57 +255,252 @@ class Shader:
     }
 
 
+def finish_all():
+    """Check every submitted program at once. Call it after creating the
+    Shaders of a scene and before building its meshes, so that programs
+    compile side by side instead of one per first mesh."""
+    for shader in list(Shader.programs.values()):
+        shader.finish()
+
+
 class VertexArray:
     """helper class to create and self destroy OpenGL vertex array objects."""
 
-    def __init__(self, shader, attributes, index=None, usage=GL.GL_STATIC_DRAW):
+    def __init__(
+        self,
+        shader,
+        attributes,
+        index=None,
+        usage=GL.GL_STATIC_DRAW,
+        optimize=False,
+        interleaved=False,
+        formats=None,
+        streaming=None,
+    ):
         """Vertex array from attributes and optional index array. Vertex
-        Attributes should be list of arrays with one row per vertex."""
+        Attributes should be list of arrays with one row per vertex.
+        With optimize, triangles and vertices are first reordered for the
+        post-transform vertex cache and fetch locality. With interleaved,
+        all attributes share one buffer, one vertex after the other.
+        formats maps attribute names to compact GPU storage formats of
+        vertex_format, e.g. dict(normal="normal", tex_coord="half").
+        streaming sets how updates avoid stalling on draws still reading
+        the buffers: "ring" for buffers rewritten every frame, "orphan"
+        (default for dynamic and stream usages), or False for in place
+        writes (default for static usage)."""
+        # attributes the shader uses with their locations, others are skipped
+        locations = {
+            name: GL.glGetAttribLocation(shader.glid, name) for name in attributes
+        }
+        attributes = {
+            name: data for name, data in attributes.items() if locations[name] >= 0
+        }
+        if optimize and index is not None and attributes:
+            attributes, index = optimize_vertex_cache(attributes, index)
+        vertex_count = max((len(data) for data in attributes.values()), default=0)
+        if streaming is None:
+            streaming = "orphan" if usage in STREAMED_USAGES else False
 
         # create vertex array object, bind it
         self.glid = GL.glGenVertexArrays(1)
         GL.glBindVertexArray(self.glid)
         self.buffers = {}  # we will store buffers in a named dict
-        nb_primitives, size = 0, 0
+        self.vertices = None  # CPU copy of the interleaved buffer, if any
+        self.formats = formats or {}
+        self.usage, self.streaming = usage, streaming
+        self.copies = {}  # CPU copies of buffers that updates rewrite whole
+        self.regions = RING_REGIONS if streaming == "ring" else 1
+        self.region, self.fences = 0, [None] * self.regions
+        self.pending = deque(maxlen=self.regions - 1)  # recent updated ranges
+        nb_primitives = 0
+
+        # attributes the shader uses, converted to their storage format
+        packed = {
+            name: (locations[name], *self._pack(name, data))
+            for name, data in attributes.items()
+        }
+        if self.formats and packed:
+            used = {name: attributes[name] for name in packed}
+            report(used, {name: data for name, (_, data, _) in packed.items()})
+
+        if interleaved:
+            nb_primitives = self._interleave(packed)
 
         # load buffer per vertex attribute (in list with index = shader layout)
-        for name, data in attributes.items():
-            loc = GL.glGetAttribLocation(shader.glid, name)
-            if loc >= 0:
+        for name, (loc, data, size) in packed.items():
+            if not interleaved:
                 # bind a new vbo, upload its data to GPU, declare size and type
-                self.buffers[name] = GL.glGenBuffers(1)
-                data = np.array(data, np.float32, copy=False)  # ensure format
-                nb_primitives, size = data.shape
+                nb_primitives = len(data)
+                self._buffer(name, data)
                 GL.glEnableVertexAttribArray(loc)
-                GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[name])
-                GL.glBufferData(GL.GL_ARRAY_BUFFER, data, usage)
-                GL.glVertexAttribPointer(loc, size, GL.GL_FLOAT, False, 0, None)
+                self._pointer(name, loc, size, 0, None)
+                if streaming:
+                    self.copies[name] = data.copy()
+        self.vertex_count = nb_primitives  # rows of each ring region
 
         # optionally create and upload an index buffer for this object
         self.draw_command = GL.glDrawArrays
         self.arguments = (0, nb_primitives)
         if index is not None:
             self.buffers["index"] = GL.glGenBuffers(1)
-            index_buffer = np.array(index, np.int32, copy=False)  # good format
+            # 16 bits indices whenever the vertex count allows, else 32 bits
+            short = compact_index_type(vertex_count) == np.uint16
+            index_buffer = np.asarray(index, np.uint16 if short else np.int32)
+            index_type = GL.GL_UNSIGNED_SHORT if short else GL.GL_UNSIGNED_INT
             GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.buffers["index"])
             GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, index_buffer, usage)
             self.draw_command = GL.glDrawElements
-            self.arguments = (index_buffer.size, GL.GL_UNSIGNED_INT, None)
+            self.arguments = (index_buffer.size, index_type, None)
         GL.glBindVertexArray(0)
 
+    def _pack(self, name, data):
+        """Attribute data in its storage format, with its component count"""
+        if name in self.formats:
+            return vertex_format(self.formats[name]).pack(data)
+        data = np.asarray(data, np.float32)  # ensure format
+        data = data.reshape(len(data), -1)
+        return data, data.shape[1]
+
+    def _pointer(self, name, loc, size, stride, offset):
+        """Declare the type and layout of attribute name at location loc"""
+        fmt = vertex_format(self.formats.get(name, "float"))
+        if fmt.integer:  # integer attributes reach the shader unconverted
+            GL.glVertexAttribIPointer(loc, size, fmt.gl_type, stride, offset)
+        else:
+            GL.glVertexAttribPointer(
+                loc, size, fmt.gl_type, fmt.normalized, stride, offset
+            )
+
+    def _buffer(self, key, data):
+        """Create and bind array buffer key, with data in each ring region"""
+        self.buffers[key] = GL.glGenBuffers(1)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[key])
+        if self.regions == 1:
+            GL.glBufferData(GL.GL_ARRAY_BUFFER, data.view(np.uint8), self.usage)
+            return
+        size = data.nbytes * self.regions
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, size, None, self.usage)
+        for region in range(self.regions):
+            GL.glBufferSubData(GL.GL_ARRAY_BUFFER, region * data.nbytes, data)
+
+    def _interleave(self, packed):
+        """Pack the attributes the shader uses in one structured array, upload
+        it in a single buffer and point each attribute at its field"""
+        layout = np.dtype(
+            [
+                (name, data.dtype, data.shape[1:])
+                for name, (_, data, _) in packed.items()
+            ]
+        )
+        count = max((len(data) for _, data, _ in packed.values()), default=0)
+        self.vertices = np.zeros(count, layout)
+        for name, (_, data, _) in packed.items():
+            self.vertices[name][: len(data)] = data
+
+        self._buffer("vertices", self.vertices)
+        self.copies["vertices"] = self.vertices
+        for name, (loc, _, size) in packed.items():
+            offset = layout.fields[name][1]
+            GL.glEnableVertexAttribArray(loc)
+            self._pointer(name, loc, size, layout.itemsize, ctypes.c_void_p(offset))
+        return count
+
+    def update(self, attributes, offset=0):
+        """overwrite attribute rows from vertex offset on, keeping the buffers.
+        In place writes and ring regions upload the rows touched only, an
+        orphaned buffer gets its whole content again."""
+        changed = {}  # copied buffers -> range of rows to upload
+        for name, data in attributes.items():
+            data = self._pack(name, data)[0]
+            stop = offset + len(data)
+            if self.vertices is not None:  # interleaved: write the field
+                self.vertices[name][offset:stop] = data
+                name = "vertices"
+            elif name in self.copies:
+                self.copies[name][offset:stop] = data
+            else:  # static buffer without copy, upload rows as they come
+                self._upload(name, offset, data)
+                continue
+            start, end = changed.get(name, (offset, stop))
+            changed[name] = (min(start, offset), max(end, stop))
+
+        if self.streaming == "ring" and changed:
+            self._write_region(changed)
+            return
+        for key, (start, stop) in changed.items():
+            data = self.copies[key]
+            if self.streaming == "orphan":
+                # fresh storage for the next draws, older ones keep theirs
+                GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[key])
+                GL.glBufferData(GL.GL_ARRAY_BUFFER, data.nbytes, None, self.usage)
+                GL.glBufferSubData(GL.GL_ARRAY_BUFFER, 0, data.view(np.uint8))
+            else:
+                self._upload(key, start, data[start:stop])
+
+    def _upload(self, key, start, data):
+        """Write data rows in buffer key from row start on"""
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[key])
+        GL.glBufferSubData(
+            GL.GL_ARRAY_BUFFER, start * data.strides[0], data.view(np.uint8)
+        )
+
+    def _write_region(self, changed):
+        """Move to the next ring region once the GPU is done with its last
+        draw, and write there the rows changed since it was last written"""
+        self.region = (self.region + 1) % self.regions
+        fence = self.fences[self.region]
+        if fence is not None:
+            GL.glClientWaitSync(fence, GL.GL_SYNC_FLUSH_COMMANDS_BIT, FENCE_TIMEOUT)
+            GL.glDeleteSync(fence)
+            self.fences[self.region] = None
+        start = min(start for start, *_ in changed.values())
+        stop = max(stop for _, stop, *_ in changed.values())
+        # this region also misses the updates written to the regions between
+        written = (start, stop)
+        for older_start, older_stop in self.pending:
+            start, stop = min(start, older_start), max(stop, older_stop)
+        self.pending.append(written)
+        for key, data in self.copies.items():
+            row = data.strides[0]
+            size = (stop - start) * row
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[key])
+            # the fence guarantees no draw reads this range anymore
+            pointer = GL.glMapBufferRange(
+                GL.GL_ARRAY_BUFFER,
+                (self.region * len(data) + start) * row,
+                size,
+                GL.GL_MAP_WRITE_BIT
+                | GL.GL_MAP_INVALIDATE_RANGE_BIT
+                | GL.GL_MAP_UNSYNCHRONIZED_BIT,
+            )
+            ctypes.memmove(pointer, data[start:stop].ctypes.data, size)
+            GL.glUnmapBuffer(GL.GL_ARRAY_BUFFER)
+
     def execute(self, primitive, attributes=None):
         """draw a vertex array, either as direct array or indexed array"""
 
         # optionally update the data attribute VBOs, useful for e.g. particles
-        attributes = attributes or {}
-        for name, data in attributes.items():
-            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[name])
-            GL.glBufferSubData(GL.GL_ARRAY_BUFFER, 0, data)
+        self.update(attributes or {})
         GL.glBindVertexArray(self.glid)
-        self.draw_command(primitive, *self.arguments)
+        base = self.region * self.vertex_count  # first vertex of ring region
+        if not base:
+            self.draw_command(primitive, *self.arguments)
+        elif self.draw_command == GL.glDrawElements:
+            GL.glDrawElementsBaseVertex(primitive, *self.arguments, base)
+        else:
+            GL.glDrawArrays(primitive, base, self.vertex_count)
         GL.glBindVertexArray(0)
+        if self.streaming == "ring":
+            # the region is free again once the GPU passes this fence
+            fence = GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+            if self.fences[self.region] is not None:
+                GL.glDeleteSync(self.fences[self.region])
+            self.fences[self.region] = fence
 
     def __del__(self):  # object dies => kill GL array and buffers from GPU
+        for fence in self.fences:
+            if fence is not None:
+                GL.glDeleteSync(fence)
         GL.glDeleteVertexArrays(1, [self.glid])
         GL.glDeleteBuffers(len(self.buffers), list(self.buffers.values()))
 
@@ -169,11 +510,22 @@ class Mesh:
     """Basic mesh class, attributes and uniforms passed as arguments"""
 
     def __init__(
-        self, shader, attributes, index=None, usage=GL.GL_STATIC_DRAW, **uniforms
+        self,
+        shader,
+        attributes,
+        index=None,
+        usage=GL.GL_STATIC_DRAW,
+        optimize=False,
+        interleaved=False,
+        formats=None,
+        streaming=None,
+        **uniforms,
     ):
         self.shader = shader
         self.uniforms = uniforms
-        self.vertex_array = VertexArray(shader, attributes, index, usage)
+        self.vertex_array = VertexArray(
+            shader, attributes, index, usage, optimize, interleaved, formats, streaming
+        )
 
     def draw(self, primitives=GL.GL_TRIANGLES, attributes=None, **uniforms):
         """Draw function to draw a mesh"""
@@ -212,9 +564,9 @@ MAX_BONES = 128
 
 # optionally load texture module
 try:
-    from texture import Texture, Textured
+    from texture import Texture, Textured, prefetch
 except ImportError:
-    Texture, Textured = None, None
+    Texture, Textured, prefetch = None, None, None
 
 # optionally load animation module
 try:
@@ -223,143 +575,312 @@ except ImportError:
     KeyFrameControlNode, Skinned = None, None
 
 
+class FileIndex:
+    """Files of a directory subtree by name, walked once. Lookups try the
+    exact name, then ignoring case, then names prefix of one another."""
+
+    indices = {}  # indices by absolute directory, shared by load calls
+
+    def __init__(self, root):
+        self.paths, self.folded, self.rank = {}, {}, {}
+        for directory, _, names in os.walk(root, followlinks=True):
+            for name in names:
+                # first file met in walk order wins, as the walk search did
+                if name not in self.paths:
+                    self.paths[name] = os.path.join(directory, name)
+                    self.rank[name] = len(self.rank)
+                self.folded.setdefault(name.lower(), self.paths[name])
+        self.names = sorted(self.paths)
+
+    @classmethod
+    def of(cls, root):
+        """Index of directory root, built on first use"""
+        key = os.path.abspath(root)
+        if key not in cls.indices:
+            cls.indices[key] = cls(root)
+        return cls.indices[key]
+
+    def find(self, name):
+        """Path of the file best matching name, None if no file does"""
+        if name in self.paths:
+            return self.paths[name]
+        if name.lower() in self.folded:
+            return self.folded[name.lower()]
+        # files whose name starts name, then files whose name name starts
+        matches = [name[:i] for i in range(1, len(name)) if name[:i] in self.paths]
+        start = bisect.bisect_left(self.names, name)
+        for other in self.names[start:]:
+            if not other.startswith(name):
+                break
+            matches.append(other)
+        return self.paths[min(matches, key=self.rank.get)] if matches else None
+
+
+def vertex_bones(vertex_count, bones, limit=4):
+    """Ids and weights of the limit most influential bones of each vertex, as
+    (vertex_count, limit) arrays padded with zero weights, weights summing
+    to 1. Bone ids are indices in bones."""
+    entries = [
+        (entry.mVertexId, entry.mWeight, bone_id)
+        for bone_id, bone in enumerate(bones)
+        for entry in bone.mWeights
+    ]
+    entries = np.array(entries, np.float64).reshape(-1, 3)
+    vertex, weight, bone = entries[:, 0].astype(np.int64), entries[:, 1], entries[:, 2]
+
+    # entries grouped by vertex, heaviest first, then rank in their group
+    order = np.lexsort((-weight, vertex))
+    vertex, weight, bone = vertex[order], weight[order], bone[order]
+    starts = np.searchsorted(vertex, vertex)
+    rank = np.arange(len(vertex)) - starts
+    kept = rank < limit
+
+    ids = np.zeros((vertex_count, limit), np.uint32)
+    weights = np.zeros((vertex_count, limit), np.float32)
+    ids[vertex[kept], rank[kept]] = bone[kept]
+    weights[vertex[kept], rank[kept]] = weight[kept]
+    total = weights.sum(axis=1, keepdims=True)
+    np.divide(weights, total, out=weights, where=total > 0)
+    return ids, weights
+
+
+def _name(text):
+    """assimp names as str"""
+    return text.decode() if isinstance(text, bytes) else str(text)
+
+
+def import_scene(file):
+    """Post-processed assimp scene of a model file as flat arrays: vertex
+    attributes, indices and bone offsets of each mesh, keyframes of the first
+    animation, and the description of nodes, meshes and materials"""
+    pp = assimpcy.aiPostProcessSteps
+    flags = pp.aiProcess_JoinIdenticalVertices | pp.aiProcess_FlipUVs
+    flags |= pp.aiProcess_OptimizeMeshes | pp.aiProcess_Triangulate
+    flags |= pp.aiProcess_GenSmoothNormals
+    flags |= pp.aiProcess_ImproveCacheLocality
+    flags |= pp.aiProcess_RemoveRedundantMaterials
+    scene = assimpcy.aiImportFile(file, flags)
+    arrays = {}
+
+    # ----- materials, textures are resolved when loading
+    materials = []
+    for mat in scene.mMaterials:
+        props = mat.properties
+        texture = props.get("TEXTURE_BASE")  # texture token
+        materials.append(
+            dict(
+                k_d=np.ravel(props.get("COLOR_DIFFUSE", (1, 1, 1))).tolist(),
+                k_s=np.ravel(props.get("COLOR_SPECULAR", (1, 1, 1))).tolist(),
+                k_a=np.ravel(props.get("COLOR_AMBIENT", (0, 0, 0))).tolist(),
+                s=float(np.ravel(props.get("SHININESS", 16.0))[0]),
+                texture=texture.split("/")[-1].split("\\")[-1] if texture else None,
+            )
+        )
+
+    # ----- mesh vertex attributes and skinning data
+    meshes = []
+    for mesh_id, mesh in enumerate(scene.mMeshes):
+        attributes = dict(position=mesh.mVertices, normal=mesh.mNormals)
+        if mesh.HasTextureCoords[0]:
+            attributes.update(tex_coord=mesh.mTextureCoords[0])
+        if mesh.HasVertexColors[0]:
+            attributes.update(color=mesh.mColors[0])
+        bones = []
+        if mesh.HasBones:
+            # skinned mesh: weights given per bone => convert per vertex for GPU
+            bone_ids, bone_weights = vertex_bones(
+                mesh.mNumVertices, mesh.mBones[:MAX_BONES]
+            )
+            attributes.update(bone_ids=bone_ids, bone_weights=bone_weights)
+            bones = [_name(bone.mName) for bone in mesh.mBones]
+            arrays[f"mesh{mesh_id}_bone_offsets"] = np.array(
+                [bone.mOffsetMatrix for bone in mesh.mBones], np.float32
+            )
+        for name, data in attributes.items():
+            arrays[f"mesh{mesh_id}_{name}"] = np.asarray(data)
+        arrays[f"mesh{mesh_id}_index"] = np.asarray(mesh.mFaces)
+        meshes.append(
+            dict(
+                material=int(mesh.mMaterialIndex),
+                attributes=list(attributes),
+                bones=bones,
+                faces=int(mesh.mNumFaces),
+            )
+        )
+
+    # ----- first animation in scene file (could be a loop over all animations)
+    channels = []
+    if scene.HasAnimations:
+        anim = scene.mAnimations[0]
+        for channel_id, channel in enumerate(anim.mChannels):
+            # rows of time followed by value, for translation, rotation, scale
+            for kind, keys in (
+                ("position", channel.mPositionKeys),
+                ("rotation", channel.mRotationKeys),
+                ("scaling", channel.mScalingKeys),
+            ):
+                arrays[f"channel{channel_id}_{kind}"] = np.array(
+                    [
+                        (key.mTime / anim.mTicksPerSecond, *np.ravel(key.mValue))
+                        for key in keys
+                    ],
+                    np.float64,
+                )
+            channels.append(_name(channel.mNodeName))
+
+    def describe_node(assimp_node):
+        return dict(
+            name=_name(assimp_node.mName),
+            transform=np.asarray(assimp_node.mTransformation).tolist(),
+            meshes=[int(index) for index in assimp_node.mMeshes],
+            children=[describe_node(child) for child in assimp_node.mChildren],
+        )
+
+    arrays["scene"] = scene_cache.describe(
+        dict(
+            root=describe_node(scene.mRootNode),
+            materials=materials,
+            meshes=meshes,
+            channels=channels,
+            animations=int(scene.mNumAnimations),
+        )
+    )
+    return arrays
+
+
+# uploaded meshes by file identity, shader, load arguments and mesh index,
+# shared by every load call with the same arguments while some are in use
+_meshes = weakref.WeakValueDictionary()
+# imported scene arrays and description by file path, modification time and
+# size, so that loading a file again only builds its node hierarchy
+_scenes = {}
+
+
 def load(file, shader, tex_file=None, **params):
-    """load resources from file using assimp, return node hierarchy"""
+    """load resources from file using assimp, return node hierarchy.
+    Imported scenes are cached on disk until the file changes. Each call
+    builds its own node hierarchy, loading the same file again shares the
+    meshes and textures of the previous loads."""
     try:
-        pp = assimpcy.aiPostProcessSteps
-        flags = pp.aiProcess_JoinIdenticalVertices | pp.aiProcess_FlipUVs
-        flags |= pp.aiProcess_OptimizeMeshes | pp.aiProcess_Triangulate
-        flags |= pp.aiProcess_GenSmoothNormals
-        flags |= pp.aiProcess_ImproveCacheLocality
-        flags |= pp.aiProcess_RemoveRedundantMaterials
-        scene = assimpcy.aiImportFile(file, flags)
+        stat = os.stat(file)
+        identity = (os.path.abspath(file), stat.st_mtime_ns, stat.st_size)
+        if identity not in _scenes:
+            arrays = scene_cache.scene_cache.get_scene(file, import_scene)
+            _scenes[identity] = (arrays, scene_cache.description(arrays))
     except assimpcy.all.AssimpError as exception:
         print("ERROR loading", file + ": ", exception.args[0].decode())
         return []
+    except OSError as exception:
+        print("ERROR loading", file + ": ", exception)
+        return []
+    key = (*identity, shader, tex_file, repr(sorted(params.items())))
+    return [_load_scene(file, *_scenes[identity], shader, tex_file, params, key)]
 
+
+def _diffuse_maps(file, scene, tex_file):
+    """Textures of the scene materials, by material index"""
     # ----- Pre-load textures; embedded textures not supported at the moment
     path = os.path.dirname(file) if os.path.dirname(file) != "" else "./"
-    for mat in scene.mMaterials:
+    tex_files = []  # (material index, texture file) pairs
+    for mat_id, mat in enumerate(scene["materials"]):
         if tex_file:
             tfile = tex_file
-        elif "TEXTURE_BASE" in mat.properties:  # texture token
-            name = mat.properties["TEXTURE_BASE"].split("/")[-1].split("\\")[-1]
+        elif mat["texture"]:
+            name = mat["texture"]
             # search texture in file's whole subdir since path often screwed up
-            paths = os.walk(path, followlinks=True)
-            tfile = next(
-                (
-                    os.path.join(d, f)
-                    for d, _, n in paths
-                    for f in n
-                    if name.startswith(f) or f.startswith(name)
-                ),
-                None,
-            )
+            tfile = FileIndex.of(path).find(name)
             assert tfile, "Cannot find texture %s in %s subtree" % (name, path)
         else:
             tfile = None
         if Texture is not None and tfile:
-            mat.properties["diffuse_map"] = Texture(tex_file=tfile)
+            tex_files.append((mat_id, tfile))
+    if tex_files:
+        prefetch(tfile for _, tfile in tex_files)  # decode them all at once
+    return {mat_id: Texture(tex_file=tfile) for mat_id, tfile in tex_files}
+
+
+def _load_scene(file, arrays, scene, shader, tex_file, params, key):
+    """Node hierarchy of the scene arrays made by import_scene and their
+    description, with the shared meshes stored under key, created if not in
+    use anymore"""
 
     # ----- load animations
-    def conv(assimp_keys, ticks_per_second):
-        """Conversion from assimp key struct to our dict representation"""
-        return {key.mTime / ticks_per_second: key.mValue for key in assimp_keys}
+    def conv(keys):
+        """Conversion from time and value rows to our dict representation"""
+        return {row[0]: row[1:] for row in np.asarray(keys)}
 
-    # load first animation in scene file (could be a loop over all animations)
     transform_keyframes = {}
-    if scene.HasAnimations:
-        anim = scene.mAnimations[0]
-        for channel in anim.mChannels:
-            # for each animation bone, store TRS dict with {times: transforms}
-            transform_keyframes[channel.mNodeName] = (
-                conv(channel.mPositionKeys, anim.mTicksPerSecond),
-                conv(channel.mRotationKeys, anim.mTicksPerSecond),
-                conv(channel.mScalingKeys, anim.mTicksPerSecond),
-            )
+    for channel_id, name in enumerate(scene["channels"]):
+        # for each animation bone, store TRS dict with {times: transforms}
+        transform_keyframes[name] = tuple(
+            conv(arrays[f"channel{channel_id}_{kind}"])
+            for kind in ("position", "rotation", "scaling")
+        )
 
     # ---- prepare scene graph nodes
     nodes = {}  # nodes name -> node lookup
-    nodes_per_mesh_id = [[] for _ in scene.mMeshes]  # nodes holding a mesh_id
+    nodes_per_mesh_id = [[] for _ in scene["meshes"]]  # nodes holding a mesh_id
 
-    def make_nodes(assimp_node):
+    def make_nodes(description):
         """Recursively builds nodes for our graph, matching assimp nodes"""
-        keyframes = transform_keyframes.get(assimp_node.mName, None)
+        keyframes = transform_keyframes.get(description["name"], None)
+        transform = np.array(description["transform"], np.float32)
         if keyframes and KeyFrameControlNode:
-            node = KeyFrameControlNode(*keyframes, assimp_node.mTransformation)
+            node = KeyFrameControlNode(*keyframes, transform)
         else:
-            node = Node(transform=assimp_node.mTransformation)
-        nodes[assimp_node.mName] = node
-        for mesh_index in assimp_node.mMeshes:
+            node = Node(transform=transform)
+        nodes[description["name"]] = node
+        for mesh_index in description["meshes"]:
             nodes_per_mesh_id[mesh_index] += [node]
-        node.add(*(make_nodes(child) for child in assimp_node.mChildren))
+        node.add(*(make_nodes(child) for child in description["children"]))
         return node
 
-    root_node = make_nodes(scene.mRootNode)
+    root_node = make_nodes(scene["root"])
 
-    # ---- create optionally decorated (Skinned, Textured) Mesh objects
-    for mesh_id, mesh in enumerate(scene.mMeshes):
+    # ---- create optionally Textured Mesh objects, unless already in use
+    shared = [_meshes.get((key, mesh_id)) for mesh_id in range(len(scene["meshes"]))]
+    diffuse_maps = _diffuse_maps(file, scene, tex_file) if None in shared else {}
+    for mesh_id, mesh in enumerate(scene["meshes"]):
+        if shared[mesh_id] is not None:
+            continue
         # retrieve materials associated to this mesh
-        mat = scene.mMaterials[mesh.mMaterialIndex].properties
+        mat = scene["materials"][mesh["material"]]
 
         # initialize mesh with args from file, merge and override with params
-        index = mesh.mFaces
-        uniforms = dict(
-            k_d=mat.get("COLOR_DIFFUSE", (1, 1, 1)),
-            k_s=mat.get("COLOR_SPECULAR", (1, 1, 1)),
-            k_a=mat.get("COLOR_AMBIENT", (0, 0, 0)),
-            s=mat.get("SHININESS", 16.0),
-        )
-        attributes = dict(
-            position=mesh.mVertices,
-            normal=mesh.mNormals,
+        index = arrays[f"mesh{mesh_id}_index"]
+        uniforms = dict(k_d=mat["k_d"], k_s=mat["k_s"], k_a=mat["k_a"], s=mat["s"])
+        attributes = {
+            name: arrays[f"mesh{mesh_id}_{name}"] for name in mesh["attributes"]
+        }
+
+        # packed normals, half tex coords, byte colors, weights and bone ids
+        new_mesh = Mesh(
+            shader, attributes, index, formats=COMPACT, **{**uniforms, **params}
         )
 
-        # ---- optionally add texture coordinates attribute if present
-        if mesh.HasTextureCoords[0]:
-            attributes.update(tex_coord=mesh.mTextureCoords[0])
-
-        # --- optionally add vertex colors as attributes if present
-        if mesh.HasVertexColors[0]:
-            attributes.update(color=mesh.mColors[0])
-
-        # ---- compute and add optional skinning vertex attributes
-        if mesh.HasBones:
-            # skinned mesh: weights given per bone => convert per vertex for GPU
-            # first, populate an array with MAX_BONES entries per vertex
-            vbone = np.array(
-                [[(0, 0)] * MAX_BONES] * mesh.mNumVertices,
-                dtype=[("weight", "f4"), ("id", "u4")],
-            )
-            for bone_id, bone in enumerate(mesh.mBones[:MAX_BONES]):
-                for entry in bone.mWeights:  # need weight,id pairs for sorting
-                    vbone[entry.mVertexId][bone_id] = (entry.mWeight, bone_id)
-
-            vbone.sort(order="weight")  # sort rows, high weights last
-            vbone = vbone[:, -4:]  # limit bone size, keep highest 4
-
-            attributes.update(bone_ids=vbone["id"], bone_weights=vbone["weight"])
-
-        new_mesh = Mesh(shader, attributes, index, **{**uniforms, **params})
+        if Textured is not None and mesh["material"] in diffuse_maps:
+            new_mesh = Textured(new_mesh, diffuse_map=diffuse_maps[mesh["material"]])
+        shared[mesh_id] = _meshes[key, mesh_id] = new_mesh
 
-        if Textured is not None and "diffuse_map" in mat:
-            new_mesh = Textured(new_mesh, diffuse_map=mat["diffuse_map"])
-        if Skinned and mesh.HasBones:
+    # ---- skinning follows the bone nodes of this hierarchy
+    for mesh_id, mesh in enumerate(scene["meshes"]):
+        new_mesh = shared[mesh_id]
+        if Skinned and mesh["bones"]:
             # make bone lookup array & offset matrix, indexed by bone index (id)
-            bone_nodes = [nodes[bone.mName] for bone in mesh.mBones]
-            bone_offsets = [bone.mOffsetMatrix for bone in mesh.mBones]
+            bone_nodes = [nodes[name] for name in mesh["bones"]]
+            bone_offsets = arrays[f"mesh{mesh_id}_bone_offsets"]
             new_mesh = Skinned(new_mesh, bone_nodes, bone_offsets)
         for node_to_populate in nodes_per_mesh_id[mesh_id]:
             node_to_populate.add(new_mesh)
 
-    nb_triangles = sum((mesh.mNumFaces for mesh in scene.mMeshes))
+    nb_triangles = sum(mesh["faces"] for mesh in scene["meshes"])
     print(
         "Loaded",
         file,
         "\t(%d meshes, %d faces, %d nodes, %d animations)"
-        % (scene.mNumMeshes, nb_triangles, len(nodes), scene.mNumAnimations),
+        % (len(scene["meshes"]), nb_triangles, len(nodes), scene["animations"]),
     )
-    return [root_node]
+    return root_node
 
 
 #------------  Viewer class & window management ------------------------------
@@ -0,0 +1,105 @@
+"""
+Build time decimation of terrain grids.
+Nearly flat regions of a grid are merged in large polygons before upload.
+"""
+# external module
+import numpy as np  # grids and triangles are numpy arrays
+
+from transform import grid_triangles
+
+
+def flat_rectangles(heights, tolerance):
+    """Greedy cover of the flat cells of a height grid by rectangles whose
+    heights span at most tolerance. Returns (i0, j0, i1, j1) vertex bounds
+    of the rectangles of more than one cell, and the mask of the cells they
+    cover."""
+    corners = np.stack(
+        (heights[:-1, :-1], heights[1:, :-1], heights[:-1, 1:], heights[1:, 1:])
+    )
+    low, high = corners.min(axis=0), corners.max(axis=0)
+    flat = high - low <= tolerance
+    covered = np.zeros(flat.shape, bool)
+    rectangles = []
+    for i in range(flat.shape[0]):
+        for j in np.flatnonzero(flat[i]).tolist():
+            if covered[i, j]:
+                continue
+            bottom, top = low[i, j], high[i, j]
+            # widen along the row, then grow the row span cell row by cell row
+            j1 = j + 1
+            while j1 < flat.shape[1] and flat[i, j1] and not covered[i, j1]:
+                new_bottom, new_top = min(bottom, low[i, j1]), max(top, high[i, j1])
+                if new_top - new_bottom > tolerance:
+                    break
+                bottom, top, j1 = new_bottom, new_top, j1 + 1
+            i1 = i + 1
+            while i1 < flat.shape[0]:
+                row = slice(j, j1)
+                if not flat[i1, row].all() or covered[i1, row].any():
+                    break
+                new_bottom = min(bottom, low[i1, row].min())
+                new_top = max(top, high[i1, row].max())
+                if new_top - new_bottom > tolerance:
+                    break
+                bottom, top, i1 = new_bottom, new_top, i1 + 1
+            if (i1 - i) * (j1 - j) > 1:
+                covered[i:i1, j:j1] = True
+                rectangles.append((i, j, i1, j1))
+    return rectangles, covered
+
+
+def decimate_grid(positions, shape, tolerance=0.0):
+    """Decimate a row-major grid of positions with shape = (rows, cols),
+    merging cells whose heights span at most tolerance. The grid border is
+    kept as is, so that it still matches its neighbors, and merged polygons
+    keep every vertex other cells use on their sides, so that no crack
+    appears. Returns the used positions and counter clockwise triangles."""
+    rows, cols = shape
+    grid = np.asarray(positions, np.float64).reshape(rows, cols, 3)
+    rectangles, covered = flat_rectangles(grid[..., 2], tolerance)
+
+    # cells left alone keep their two triangles
+    cells = grid_triangles(rows, cols).astype(np.int64).reshape(-1, 2, 3)
+    triangles = [cells[~covered.ravel()].reshape(-1, 3)]
+
+    # vertices on the border or at a corner of some cell or rectangle
+    used = np.zeros((rows, cols), bool)
+    used[[0, -1], :] = used[:, [0, -1]] = True
+    single = ~covered
+    used[:-1, :-1] |= single
+    used[1:, :-1] |= single
+    used[:-1, 1:] |= single
+    used[1:, 1:] |= single
+    for i0, j0, i1, j1 in rectangles:
+        used[[i0, i0, i1, i1], [j0, j1, j0, j1]] = True
+
+    centers = []
+    index = np.arange(rows * cols).reshape(rows, cols)
+    for i0, j0, i1, j1 in rectangles:
+        # counter clockwise walk along the sides, keeping used vertices
+        sides = (
+            index[i0:i1, j0][used[i0:i1, j0]],
+            index[i1, j0:j1][used[i1, j0:j1]],
+            index[i1:i0:-1, j1][used[i1:i0:-1, j1]],
+            index[i0, j1:j0:-1][used[i0, j1:j0:-1]],
+        )
+        loop = np.concatenate(sides)
+        if len(loop) == 4:
+            triangles.append(loop[[[0, 1, 2], [0, 2, 3]]])
+        else:  # fan around a center vertex, avoiding flat triangles
+            center = rows * cols + len(centers)
+            corners = grid[[i0, i1, i1, i0], [j0, j0, j1, j1]]
+            centers.append(corners.mean(axis=0))
+            triangles.append(
+                np.column_stack(
+                    (np.full(len(loop), center), loop, np.roll(loop, -1))
+                )
+            )
+
+    # drop the vertices no triangle uses anymore
+    positions = np.vstack([grid.reshape(-1, 3)] + centers)
+    triangles = np.concatenate(triangles)
+    kept = np.zeros(len(positions), bool)
+    kept[triangles.ravel()] = True
+    remap = np.cumsum(kept) - 1
+    return positions[kept], remap[triangles]
@@ -1,809 +1,295 @@
 """ Floor asset to create the gigantic map """
 
-import math as Math
+from functools import partial  # picklable height functions
 
 import numpy as np  # all matrix manipulations & OpenGL args
 import OpenGL.GL as GL  # standard Python OpenGL wrapper
-from perlin_noise import PerlinNoise  # pip install perlin-noise
 
-from core import Mesh
+from core import Mesh, Node
+from decimate import decimate_grid
+from heightfield import Heightfield
+from heightmap import HeightmapMesh, heightmap_normals
+from heights import FLOOR_NOISES, bottom_height, top_height
+from mesh_cache import mesh_cache
+from parallel import evaluate
 from texture import Texture, Textured
-from transform import compute_normals
+from transform import compact_index_type, compute_normals, grid_triangles
+from vertex_cache import optimize as optimize_vertex_cache
 
-noise1 = PerlinNoise(octaves=3)
-noise2 = PerlinNoise(octaves=6)
-noise3 = PerlinNoise(octaves=12)
+# the four corners of the island, as (x, y) sign multipliers
+QUADRANTS = ((1, 1), (-1, 1), (-1, -1), (1, -1))
 
 
-class Floor(Textured):
-    """Simple first textured object"""
+# Island building blocks, all working on xy points ----------------------------
+def arc(center, radius, count):
+    """count points on the quarter circle of first quadrant around center"""
+    angles = np.linspace(0, np.pi / 2, count)
+    return np.column_stack(
+        (center[0] + radius * np.cos(angles), center[1] + radius * np.sin(angles))
+    )
 
-    def __init__(self, shader, tex_file, tex_file2, tex_file3):
-        self.wrap, self.filter = GL.GL_REPEAT, (
-            GL.GL_LINEAR,
-            GL.GL_LINEAR_MIPMAP_LINEAR,
-        )
-        self.file = tex_file
-        self.file2 = tex_file2
-        self.file3 = tex_file3
 
-        # setup plane mesh to be textured
-        positions = []
-        tex_coords = []
-        for i in range(-150, 151):
-            for j in range(-150, 151):
-                positions.append(
-                    (
-                        i,
-                        j,
-                        10
-                        * self.getAltitude(i, j, 0.33)
-                        * self.smoothStep(130, 150, i, j),
-                    )
-                )
-                tex_coords.append(((150 + i) * 3 / 150, (150 + j) * 3 / 150))
-
-        longueur_base = len(positions)
-
-        # Rectangles extérieurs supérieurs
-
-        for i in range(150, 181):
-            for j in range(-150, 151):
-                positions.append((i, j, 0))
-                tex_coords.append(((150 + i) * 3 / 150, (150 + j) * 3 / 150))
-
-        longueur_rectangle = len(positions) - longueur_base
-
-        for i in range(-180, -149):
-            for j in range(-150, 151):
-                positions.append((i, j, 0))
-                tex_coords.append(((150 + i) * 3 / 150, (150 + j) * 3 / 150))
-
-        for i in range(-150, 151):
-            for j in range(-180, -149):
-                positions.append((i, j, 0))
-                tex_coords.append(((150 + i) * 3 / 150, (150 + j) * 3 / 150))
-
-        for i in range(-150, 151):
-            for j in range(150, 181):
-                positions.append((i, j, 0))
-                tex_coords.append(((150 + i) * 3 / 150, (150 + j) * 3 / 150))
-
-        # Coins supérieurs
-
-        positions.append((150, 150, 0))
-        tex_coords.append((6, 6))
-        for i in range(20):
-            positions.append(
-                (
-                    150 + 30 * np.cos(2 * np.pi * i / 40),
-                    150 + 30 * np.sin(2 * np.pi * i / 40),
-                    0,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + 150 + 30 * np.cos(2 * np.pi * i / 40)) * 3 / 150,
-                    (150 + 150 + 30 * np.sin(2 * np.pi * i / 40)) * 3 / 150,
-                )
-            )
-            positions.append(
-                (
-                    150 + 30 * np.cos(2 * np.pi * (i + 1) / 40),
-                    150 + 30 * np.sin(2 * np.pi * (i + 1) / 40),
-                    0,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + 150 + 30 * np.cos(2 * np.pi * (i + 1) / 40)) * 3 / 150,
-                    (150 + 150 + 30 * np.sin(2 * np.pi * (i + 1) / 40)) * 3 / 150,
-                )
-            )
+def samples(start, stop, step):
+    """Regular samples from start to stop, about step apart"""
+    return np.linspace(start, stop, max(2, round(abs(stop - start) / step) + 1))
 
-        positions.append((-150, 150, 0))
-        tex_coords.append((0, 6))
-        for i in range(20):
-            positions.append(
-                (
-                    -150 + 30 * np.cos(2 * np.pi * (i + 20) / 40),
-                    150 - 30 * np.sin(2 * np.pi * (i + 20) / 40),
-                    0,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + -150 + 30 * np.cos(2 * np.pi * (i + 20) / 40)) * 3 / 150,
-                    (150 + 150 - 30 * np.sin(2 * np.pi * (i + 20) / 40)) * 3 / 150,
-                )
-            )
-            positions.append(
-                (
-                    -150 + 30 * np.cos(2 * np.pi * (i + 20 + 1) / 40),
-                    150 - 30 * np.sin(2 * np.pi * (i + 20 + 1) / 40),
-                    0,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + -150 + 30 * np.cos(2 * np.pi * (i + 20 + 1) / 40)) * 3 / 150,
-                    (150 + 150 - 30 * np.sin(2 * np.pi * (i + 20 + 1) / 40)) * 3 / 150,
-                )
-            )
 
-        positions.append((-150, -150, 0))
-        tex_coords.append((0, 0))
-        for i in range(20):
-            positions.append(
-                (
-                    -150 - 30 * np.cos(2 * np.pi * i / 40),
-                    -150 - 30 * np.sin(2 * np.pi * i / 40),
-                    0,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + -150 - 30 * np.cos(2 * np.pi * i / 40)) * 3 / 150,
-                    (150 + -150 - 30 * np.sin(2 * np.pi * i / 40)) * 3 / 150,
-                )
-            )
-            positions.append(
-                (
-                    -150 - 30 * np.cos(2 * np.pi * (i + 1) / 40),
-                    -150 - 30 * np.sin(2 * np.pi * (i + 1) / 40),
-                    0,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + -150 - 30 * np.cos(2 * np.pi * (i + 1) / 40)) * 3 / 150,
-                    (150 + -150 - 30 * np.sin(2 * np.pi * (i + 1) / 40)) * 3 / 150,
-                )
-            )
-
-        positions.append((150, -150, 0))
-        tex_coords.append((6, 0))
-        for i in range(20):
-            positions.append(
-                (
-                    150 + 30 * np.cos(2 * np.pi * i / 40),
-                    -150 - 30 * np.sin(2 * np.pi * i / 40),
-                    0,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + 150 + 30 * np.cos(2 * np.pi * i / 40)) * 3 / 150,
-                    (150 + -150 - 30 * np.sin(2 * np.pi * i / 40)) * 3 / 150,
-                )
-            )
-            positions.append(
-                (
-                    150 + 30 * np.cos(2 * np.pi * (i + 1) / 40),
-                    -150 - 30 * np.sin(2 * np.pi * (i + 1) / 40),
-                    0,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + 150 + 30 * np.cos(2 * np.pi * (i + 1) / 40)) * 3 / 150,
-                    (150 + -150 - 30 * np.sin(2 * np.pi * (i + 1) / 40)) * 3 / 150,
-                )
-            )
-
-        # Coins inférieurs
-
-        positions.append((120, 120, -30))
-        tex_coords.append((5.4, 5.4))
-        for i in range(20):
-            positions.append(
-                (
-                    120 + 30 * np.cos(2 * np.pi * i / 40),
-                    120 + 30 * np.sin(2 * np.pi * i / 40),
-                    -30,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + 120 + 30 * np.cos(2 * np.pi * i / 40)) * 3 / 150,
-                    (150 + 120 + 30 * np.sin(2 * np.pi * i / 40)) * 3 / 150,
-                )
-            )
-            positions.append(
-                (
-                    120 + 30 * np.cos(2 * np.pi * (i + 1) / 40),
-                    120 + 30 * np.sin(2 * np.pi * (i + 1) / 40),
-                    -30,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + 120 + 30 * np.cos(2 * np.pi * (i + 1) / 40)) * 3 / 150,
-                    (150 + 120 + 30 * np.sin(2 * np.pi * (i + 1) / 40)) * 3 / 150,
-                )
-            )
-
-        positions.append((-120, 120, -30))
-        tex_coords.append((0.6, 5.4))
-        for i in range(20):
-            positions.append(
-                (
-                    -120 + 30 * np.cos(2 * np.pi * (i + 20) / 40),
-                    120 - 30 * np.sin(2 * np.pi * (i + 20) / 40),
-                    -30,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + -120 + 30 * np.cos(2 * np.pi * (i + 20) / 40)) * 3 / 150,
-                    (150 + 120 - 30 * np.sin(2 * np.pi * (i + 20) / 40)) * 3 / 150,
-                )
-            )
-            positions.append(
-                (
-                    -120 + 30 * np.cos(2 * np.pi * (i + 20 + 1) / 40),
-                    120 - 30 * np.sin(2 * np.pi * (i + 20 + 1) / 40),
-                    -30,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + -120 + 30 * np.cos(2 * np.pi * (i + 20 + 1) / 40)) * 3 / 150,
-                    (150 + 120 - 30 * np.sin(2 * np.pi * (i + 20 + 1) / 40)) * 3 / 150,
-                )
-            )
-
-        positions.append((-120, -120, -30))
-        tex_coords.append((0.6, 0.6))
-        for i in range(20):
-            positions.append(
-                (
-                    -120 - 30 * np.cos(2 * np.pi * i / 40),
-                    -120 - 30 * np.sin(2 * np.pi * i / 40),
-                    -30,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + -120 - 30 * np.cos(2 * np.pi * i / 40)) * 3 / 150,
-                    (150 + -120 - 30 * np.sin(2 * np.pi * i / 40)) * 3 / 150,
-                )
-            )
-            positions.append(
-                (
-                    -120 - 30 * np.cos(2 * np.pi * (i + 1) / 40),
-                    -120 - 30 * np.sin(2 * np.pi * (i + 1) / 40),
-                    -30,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + -120 - 30 * np.cos(2 * np.pi * (i + 1) / 40)) * 3 / 150,
-                    (150 + -120 - 30 * np.sin(2 * np.pi * (i + 1) / 40)) * 3 / 150,
-                )
-            )
-
-        positions.append((120, -120, -30))
-        tex_coords.append(((150 + 5.4) * 3 / 150, (150 + 0.6) * 3 / 150))
-        for i in range(20):
-            positions.append(
-                (
-                    120 + 30 * np.cos(2 * np.pi * i / 40),
-                    -120 - 30 * np.sin(2 * np.pi * i / 40),
-                    -30,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + 120 + 30 * np.cos(2 * np.pi * i / 40)) * 3 / 150,
-                    (150 + -120 - 30 * np.sin(2 * np.pi * i / 40)) * 3 / 150,
-                )
-            )
-            positions.append(
-                (
-                    120 + 30 * np.cos(2 * np.pi * (i + 1) / 40),
-                    -120 - 30 * np.sin(2 * np.pi * (i + 1) / 40),
-                    -30,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + 120 + 30 * np.cos(2 * np.pi * (i + 1) / 40)) * 3 / 150,
-                    (150 + -120 - 30 * np.sin(2 * np.pi * (i + 1) / 40)) * 3 / 150,
-                )
-            )
+def patch(xs, ys):
+    """Points and triangles of a regular grid patch sampled along xs and ys"""
+    x, y = np.meshgrid(xs, ys, indexing="ij")
+    return np.column_stack((x.ravel(), y.ravel())), grid_triangles(len(xs), len(ys))
 
-        # Bords inférieurs
-
-        for i in range(-120, 121):  # Bord inférieur nord
-            positions.append((i, -150, -30))
-            tex_coords.append(((150 + i) * 3 / 150, 0))
-
-        for i in range(-120, 121):  # Bord supérieur nord
-            if i < 0:
-                positions.append((Math.floor(i * 150 / 120), -180, 0))
-                tex_coords.append(((150 + Math.floor(i * 150 / 120)) * 3 / 150, -0.6))
-            else:
-                positions.append((Math.ceil(i * 150 / 120), -180, 0))
-                tex_coords.append(((150 + Math.ceil(i * 150 / 120)) * 3 / 150, -0.6))
-
-        for i in range(-120, 121):  # Bord inférieur est
-            positions.append((150, i, -30))
-            tex_coords.append((6, (150 + i) * 3 / 150))
-
-        for i in range(-120, 121):  # Bord supérieur est
-            if i < 0:
-                positions.append((180, Math.floor(i * 150 / 120), 0))
-                tex_coords.append((6.6, (150 + Math.floor(i * 150 / 120)) * 3 / 150))
-            else:
-                positions.append((180, Math.ceil(i * 150 / 120), 0))
-                tex_coords.append((6.6, (150 + Math.ceil(i * 150 / 120)) * 3 / 150))
-
-        for i in range(-120, 121):  # Bord inférieur sud
-            positions.append((i, 150, -30))
-            tex_coords.append(((150 + i) * 3 / 150, 6))
-
-        for i in range(-120, 121):  # Bord supérieur sud
-            if i < 0:
-                positions.append((Math.floor(i * 150 / 120), 180, 0))
-                tex_coords.append(((150 + Math.floor(i * 150 / 120)) * 3 / 150, 6.6))
-            else:
-                positions.append((Math.ceil(i * 150 / 120), 180, 0))
-                tex_coords.append(((150 + Math.ceil(i * 150 / 120)) * 3 / 150, 6.6))
-
-        for i in range(-120, 121):  # Bord inférieur ouest
-            positions.append((-150, i, -30))
-            tex_coords.append((0, (150 + i) * 3 / 150))
-
-        for i in range(-120, 121):  # Bord supérieur ouest
-            if i < 0:
-                positions.append((-180, Math.floor(i * 150 / 120), 0))
-                tex_coords.append((-0.6, (150 + Math.floor(i * 150 / 120)) * 3 / 150))
-            else:
-                positions.append((-180, Math.ceil(i * 150 / 120), 0))
-                tex_coords.append((-0.6, (150 + Math.ceil(i * 150 / 120)) * 3 / 150))
-
-        # Rocher inférieur
-        for i in range(-120, 121):
-            for j in range(-120, 121):
-                positions.append(
-                    (
-                        i,
-                        j,
-                        -30
-                        - 150
-                        * self.getAltitude(i, j, 0.15)
-                        * self.smoothStep(0, 150, i, j),
-                    )
-                )
-                tex_coords.append(((150 + i) * 3 / 150, (150 + j) * 3 / 150))
-
-        # Rectangles extérieurs inférieurs
-
-        for i in range(120, 151):
-            for j in range(-120, 121):
-                positions.append(
-                    (
-                        i,
-                        j,
-                        -30
-                        - 150
-                        * self.getAltitude(i, j, 0.15)
-                        * self.smoothStep(0, 150, i, j),
-                    )
-                )
-                tex_coords.append(((150 + i) * 3 / 150, (150 + j) * 3 / 150))
-
-        longueur_petit_rectangles = len(positions)
-
-        for i in range(-150, -119):
-            for j in range(-120, 121):
-                positions.append(
-                    (
-                        i,
-                        j,
-                        -30
-                        - 150
-                        * self.getAltitude(i, j, 0.15)
-                        * self.smoothStep(0, 150, i, j),
-                    )
-                )
-                tex_coords.append(((150 + i) * 3 / 150, (150 + j) * 3 / 150))
-
-        for i in range(-120, 121):
-            for j in range(-150, -119):
-                positions.append(
-                    (
-                        i,
-                        j,
-                        -30
-                        - 150
-                        * self.getAltitude(i, j, 0.15)
-                        * self.smoothStep(0, 150, i, j),
-                    )
-                )
-                tex_coords.append(((150 + i) * 3 / 150, (150 + j) * 3 / 150))
-
-        for i in range(-120, 121):
-            for j in range(120, 151):
-                positions.append(
-                    (
-                        i,
-                        j,
-                        -30
-                        - 150
-                        * self.getAltitude(i, j, 0.15)
-                        * self.smoothStep(0, 150, i, j),
-                    )
-                )
-                tex_coords.append(((150 + i) * 3 / 150, (150 + j) * 3 / 150))
-
-        # Coins inférieurs
-
-        positions.append((120, 120, -30))
-        tex_coords.append((5.4, 5.4))
-        for i in range(20):
-            positions.append(
-                (
-                    120 + 30 * np.cos(2 * np.pi * i / 40),
-                    120 + 30 * np.sin(2 * np.pi * i / 40),
-                    -30,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + 120 + 30 * np.cos(2 * np.pi * i / 40)) * 3 / 150,
-                    (150 + 120 + 30 * np.sin(2 * np.pi * i / 40)) * 3 / 150,
-                )
-            )
-            positions.append(
-                (
-                    120 + 30 * np.cos(2 * np.pi * (i + 1) / 40),
-                    120 + 30 * np.sin(2 * np.pi * (i + 1) / 40),
-                    -30,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + 120 + 30 * np.cos(2 * np.pi * (i + 1) / 40)) * 3 / 150,
-                    (150 + 120 + 30 * np.sin(2 * np.pi * (i + 1) / 40)) * 3 / 150,
-                )
-            )
 
-        positions.append((-120, 120, -30))
-        tex_coords.append((0.6, 5.4))
-        for i in range(20):
-            positions.append(
-                (
-                    -120 + 30 * np.cos(2 * np.pi * (i + 20) / 40),
-                    120 - 30 * np.sin(2 * np.pi * (i + 20) / 40),
-                    -30,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + -120 + 30 * np.cos(2 * np.pi * (i + 20) / 40)) * 3 / 150,
-                    (150 + 120 - 30 * np.sin(2 * np.pi * (i + 20) / 40)) * 3 / 150,
-                )
-            )
-            positions.append(
-                (
-                    -120 + 30 * np.cos(2 * np.pi * (i + 20 + 1) / 40),
-                    120 - 30 * np.sin(2 * np.pi * (i + 20 + 1) / 40),
-                    -30,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + -120 + 30 * np.cos(2 * np.pi * (i + 20 + 1) / 40)) * 3 / 150,
-                    (150 + 120 - 30 * np.sin(2 * np.pi * (i + 20 + 1) / 40)) * 3 / 150,
-                )
-            )
+def sector(center, rim, count):
+    """Points and triangles of the region between center and the rim polyline,
+    sampled over count rings so that its straight sides match a grid patch"""
+    fractions = np.linspace(0, 1, count)[1:, None, None]
+    rings = (center + fractions * (rim - center)).reshape(-1, 2)
+    k = np.arange(1, len(rim))
+    triangles = np.vstack(
+        (
+            np.column_stack((np.zeros_like(k), k, k + 1)),  # around the center
+            grid_triangles(count - 1, len(rim)).astype(np.int64) + 1,
+        )
+    )
+    return np.vstack((center, rings)), triangles
+
+
+def zipper(outer, outer_t, inner, inner_t):
+    """Points and triangles of a closed band between two loops, stitched in
+    the order of their points parameters t, increasing in [0, 4)"""
+    count = len(outer)
+    # each triangle moves one step along one of the loops, smallest t first
+    steps = np.concatenate((outer_t[1:], [4], inner_t[1:], [4]))
+    on_outer = (np.arange(len(steps)) < count)[np.argsort(steps, kind="stable")]
+    i = np.cumsum(on_outer) - on_outer
+    j = np.cumsum(~on_outer) - ~on_outer
+    third = np.where(on_outer, (i + 1) % count, count + (j + 1) % len(inner))
+    triangles = np.column_stack((i % count, count + j % len(inner), third))
+    return np.vstack((outer, inner)), triangles
+
+
+def outline(half, radius, straight, segments):
+    """Closed loop around a square of half width 'half' with rounded corners,
+    each side sampled at the straight coordinates and corners over segments.
+    Returns the points and their loop parameter, side k spanning [k, k + 1)"""
+    side = np.column_stack((np.full(len(straight), half), straight))
+    corner = arc((half - radius, half - radius), radius, segments + 1)[1:-1]
+    quarter = np.vstack((side, corner))
+    fraction = (straight - straight[0]) / (straight[-1] - straight[0])
+    param = np.concatenate((fraction, 1 + np.arange(1, segments) / segments)) / 2
+    loop, loop_t = [], []
+    # next side is the previous one turned by 90 degrees
+    for k in range(len(QUADRANTS)):
+        loop.append(quarter)
+        loop_t.append(param + k)
+        quarter = np.column_stack((-quarter[:, 1], quarter[:, 0]))
+    return np.vstack(loop), np.concatenate(loop_t)
+
+
+def facing(points, triangles, up):
+    """Triangles counter clockwise seen from above if up, else from below"""
+    a, b, c = (points[triangles[:, k]] for k in range(3))
+    area = (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (
+        c[:, 0] - a[:, 0]
+    )
+    flip = area < 0 if up else area > 0
+    triangles = triangles.copy()
+    triangles[flip] = triangles[flip][:, ::-1]
+    return triangles
+
+
+def island(
+    top,
+    bottom,
+    size=150,
+    border=30,
+    depth=30,
+    radius=None,
+    segments=20,
+    step=1,
+    heightfields=True,
+    workers=1,
+    tolerance=None,
+):
+    """Floating island: a top of half width size + border, made of a size wide
+    heightfield and a flat border, over an underside of half width size lying
+    depth lower, joined by a sloped skirt. Corners are rounded with radius
+    (border by default) over segments, step is the grid spacing.
+    top(x, y) and bottom(x, y) give heights on whole arrays. Without
+    heightfields, the top and underside grids are left out, to be drawn
+    from heightmaps. Top and underside heights are evaluated by row bands
+    over workers processes if more than one, top and bottom must then be
+    picklable. Given a tolerance, grid cells whose heights span less than it
+    are merged, see decimate_grid. Returns positions and triangle indices."""
+    radius = border if radius is None else radius
+    if not 0 < radius <= min(border, size):
+        raise ValueError("corner radius expected in ]0, min(border, size)]")
+
+    span, band = samples(-size, size, step), samples(size, size + border, step)
+    inner_span = samples(radius - size, size - radius, step)
+    inner_band = samples(size - radius, size, step)
+    # top outline sides go beyond the heightfield when corners are tighter
+    extra = span[-1:]
+    if radius < border:
+        extra = samples(size, size + border - radius, step)
+    rim = np.vstack(
+        (
+            np.column_stack((np.full(len(extra) - 1, size + border), extra[:-1])),
+            arc((size + border - radius,) * 2, radius, segments + 1),
+            np.column_stack((extra[-2::-1], np.full(len(extra) - 1, size + border))),
+        )
+    )
+
+    def grid(xs, ys):  # grid patches keep their shape for decimation
+        return (*patch(xs, ys), (len(xs), len(ys)))
+
+    # top heightfield, flat border sides and corners
+    upper = [grid(span, span)] if heightfields else []
+    for side in (band, -band):
+        upper += [grid(side, span), grid(span, side)]
+    upper += [
+        (*sector(np.multiply(sign, size), sign * rim, len(band)), None)
+        for sign in QUADRANTS
+    ]
+
+    # underside heightfield, its sides and corners
+    lower = [grid(inner_span, inner_span)] if heightfields else []
+    for side in (inner_band, -inner_band):
+        lower += [grid(side, inner_span), grid(inner_span, side)]
+    center = (size - radius, size - radius)
+    corner = arc(center, radius, segments + 1)
+    lower += [
+        (*sector(np.multiply(sign, center), sign * corner, len(inner_band)), None)
+        for sign in QUADRANTS
+    ]
+
+    # skirt from the top outline down to the underside outline, sharing the
+    # samples of the border and underside edges so that no crack appears
+    straight = np.concatenate((-extra[::-1], span[1:-1], extra))
+    outer, outer_t = outline(size + border, radius, straight, segments)
+    inner, inner_t = outline(size, radius, inner_span, segments)
+    skirt_heights = np.concatenate((top(*outer.T), bottom(*inner.T) - depth))
+
+    # heights of every top point, then every underside point, in one go each
+    heights = np.concatenate(
+        (
+            evaluate(top, *np.vstack([p for p, *_ in upper]).T, workers),
+            evaluate(bottom, *np.vstack([p for p, *_ in lower]).T, workers) - depth,
+        )
+    )
+    heights = np.split(heights, np.cumsum([len(p) for p, *_ in upper + lower])[:-1])
+
+    positions, triangles, offset = [], [], 0
+    pieces = [(*piece, z) for piece, z in zip(upper + lower, heights)]
+    pieces += [(*zipper(outer, outer_t, inner, inner_t), None, skirt_heights)]
+    before = (sum(len(p) for p, *_ in pieces), sum(len(t) for _, t, *_ in pieces))
+    for k, (points, tri, shape, heights) in enumerate(pieces):
+        piece, tri = np.column_stack((points, heights)), tri.astype(np.int64)
+        if shape is not None and tolerance is not None:
+            piece, tri = decimate_grid(piece, shape, tolerance)
+        positions.append(piece)
+        up = k < len(upper)  # underside and skirt are seen from below
+        triangles.append(facing(piece, tri, up) + offset)
+        offset += len(piece)
+
+    if tolerance is not None:
+        after = (offset, sum(len(t) for t in triangles))
+        print(
+            f"Decimated island (tolerance={tolerance}): "
+            f"{before[0]} -> {after[0]} vertices, {before[1]} -> {after[1]} triangles"
+        )
+    return (
+        np.concatenate(positions),
+        np.concatenate(triangles).astype(compact_index_type(offset)),
+    )
 
-        positions.append((-120, -120, -30))
-        tex_coords.append((0.6, 0.6))
-        for i in range(20):
-            positions.append(
-                (
-                    -120 - 30 * np.cos(2 * np.pi * i / 40),
-                    -120 - 30 * np.sin(2 * np.pi * i / 40),
-                    -30,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + -120 - 30 * np.cos(2 * np.pi * i / 40)) * 3 / 150,
-                    (150 + -120 - 30 * np.sin(2 * np.pi * i / 40)) * 3 / 150,
-                )
-            )
-            positions.append(
-                (
-                    -120 - 30 * np.cos(2 * np.pi * (i + 1) / 40),
-                    -120 - 30 * np.sin(2 * np.pi * (i + 1) / 40),
-                    -30,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + -120 - 30 * np.cos(2 * np.pi * (i + 1) / 40)) * 3 / 150,
-                    (150 + -120 - 30 * np.sin(2 * np.pi * (i + 1) / 40)) * 3 / 150,
-                )
-            )
 
-        positions.append((120, -120, -30))
-        tex_coords.append((5.4, 0.6))
-        for i in range(20):
-            positions.append(
-                (
-                    120 + 30 * np.cos(2 * np.pi * i / 40),
-                    -120 - 30 * np.sin(2 * np.pi * i / 40),
-                    -30,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + 120 + 30 * np.cos(2 * np.pi * i / 40)) * 3 / 150,
-                    (150 + -120 - 30 * np.sin(2 * np.pi * i / 40)) * 3 / 150,
-                )
-            )
-            positions.append(
-                (
-                    120 + 30 * np.cos(2 * np.pi * (i + 1) / 40),
-                    -120 - 30 * np.sin(2 * np.pi * (i + 1) / 40),
-                    -30,
-                )
-            )
-            tex_coords.append(
-                (
-                    (150 + 120 + 30 * np.cos(2 * np.pi * (i + 1) / 40)) * 3 / 150,
-                    (150 + -120 - 30 * np.sin(2 * np.pi * (i + 1) / 40)) * 3 / 150,
-                )
-            )
+class Floor(Textured):
+    """Floating island with a noise heightfield on top and a rocky underside.
+    Given a heightmap_shader, both are displaced on the GPU from heightmaps.
+    Heights are generated over workers processes if more than one. Flat
+    regions are decimated within tolerance, None keeps the full grids."""
+
+    def __init__(
+        self,
+        shader,
+        tex_file,
+        tex_file2,
+        tex_file3,
+        size=150,
+        border=30,
+        depth=30,
+        radius=None,
+        segments=20,
+        step=1,
+        heightmap_shader=None,
+        workers=1,
+        tolerance=0.0,
+    ):
+        self.wrap, self.filter = GL.GL_REPEAT, (
+            GL.GL_LINEAR,
+            GL.GL_LINEAR_MIPMAP_LINEAR,
+        )
+        self.file = tex_file
+        self.file2 = tex_file2
+        self.file3 = tex_file3
+        self.size = size
+        self.top = partial(top_height, size=size)
+        self.bottom = partial(bottom_height, size=size)
+        self.workers = workers  # processes generating the heights
+        self.shape = dict(
+            size=size,
+            border=border,
+            depth=depth,
+            radius=radius,
+            segments=segments,
+            step=step,
+            tolerance=tolerance,
+        )
 
-        scaled = 2 * np.array(positions, np.float32)
-
-        indices = []
-        for i in range(300):
-            for j in range(300):
-                indices.append(i * 301 + j)
-                indices.append((i + 1) * 301 + j + 1)
-                indices.append(i * 301 + j + 1)
-                indices.append(i * 301 + j)
-                indices.append((i + 1) * 301 + j)
-                indices.append((i + 1) * 301 + j + 1)
-
-        # Rectangles extérieurs supérieurs
-
-        for i in range(30):
-            for j in range(300):
-                indices.append(longueur_base + i * 301 + j)
-                indices.append(longueur_base + (i + 1) * 301 + j + 1)
-                indices.append(longueur_base + i * 301 + j + 1)
-                indices.append(longueur_base + i * 301 + j)
-                indices.append(longueur_base + (i + 1) * 301 + j)
-                indices.append(longueur_base + (i + 1) * 301 + j + 1)
-
-        longueur_base += longueur_rectangle
-        for i in range(30):
-            for j in range(300):
-                indices.append(longueur_base + i * 301 + j)
-                indices.append(longueur_base + (i + 1) * 301 + j + 1)
-                indices.append(longueur_base + i * 301 + j + 1)
-                indices.append(longueur_base + i * 301 + j)
-                indices.append(longueur_base + (i + 1) * 301 + j)
-                indices.append(longueur_base + (i + 1) * 301 + j + 1)
-
-        longueur_base += longueur_rectangle
-        for i in range(300):
-            for j in range(30):
-                indices.append(longueur_base + i * 31 + j)
-                indices.append(longueur_base + (i + 1) * 31 + j + 1)
-                indices.append(longueur_base + i * 31 + j + 1)
-                indices.append(longueur_base + i * 31 + j)
-                indices.append(longueur_base + (i + 1) * 31 + j)
-                indices.append(longueur_base + (i + 1) * 31 + j + 1)
-
-        longueur_base += longueur_rectangle
-        for i in range(300):
-            for j in range(30):
-                indices.append(longueur_base + i * 31 + j)
-                indices.append(longueur_base + (i + 1) * 31 + j + 1)
-                indices.append(longueur_base + i * 31 + j + 1)
-                indices.append(longueur_base + i * 31 + j)
-                indices.append(longueur_base + (i + 1) * 31 + j)
-                indices.append(longueur_base + (i + 1) * 31 + j + 1)
-
-        # Coins supérieurs
-        longueur_base += longueur_rectangle
-        for i in range(20):
-            indices.append(longueur_base)
-            indices.append(longueur_base + i)
-            indices.append(longueur_base + i + 1)
-
-        longueur_base += 41
-        for i in range(20):
-            indices.append(longueur_base)
-            indices.append(longueur_base + i + 1)
-            indices.append(longueur_base + i)
-
-        longueur_base += 41
-        for i in range(20):
-            indices.append(longueur_base)
-            indices.append(longueur_base + i)
-            indices.append(longueur_base + i + 1)
-
-        longueur_base += 41
-        for i in range(20):
-            indices.append(longueur_base)
-            indices.append(longueur_base + i + 1)
-            indices.append(longueur_base + i)
-
-        longueur_base += 41
-        for i in range(20):
-            indices.append(longueur_base + i)
-            indices.append(longueur_base + i + 1 - 164)
-            indices.append(longueur_base + i - 164)
-            indices.append(longueur_base + i + 1)
-            indices.append(longueur_base + i + 1 - 164)
-            indices.append(longueur_base + i)
-
-        longueur_base += 41
-        for i in range(20):
-            indices.append(longueur_base + i)
-            indices.append(longueur_base + i - 164)
-            indices.append(longueur_base + i + 1 - 164)
-            indices.append(longueur_base + i + 1 - 164)
-            indices.append(longueur_base + i + 1)
-            indices.append(longueur_base + i)
-
-        longueur_base += 41
-        for i in range(20):
-            indices.append(longueur_base + i)
-            indices.append(longueur_base + i + 1 - 164)
-            indices.append(longueur_base + i - 164)
-            indices.append(longueur_base + i + 1)
-            indices.append(longueur_base + i + 1 - 164)
-            indices.append(longueur_base + i)
-
-        longueur_base += 41
-        for i in range(20):
-            indices.append(longueur_base + i)
-            indices.append(longueur_base + i - 164)
-            indices.append(longueur_base + i + 1 - 164)
-            indices.append(longueur_base + i + 1 - 164)
-            indices.append(longueur_base + i + 1)
-            indices.append(longueur_base + i)
-
-        longueur_base += 41
-
-        for i in range(240):
-            indices.append(longueur_base + i)
-            indices.append(longueur_base + i + 1)
-            indices.append(longueur_base + i + 241)
-            indices.append(longueur_base + i + 241)
-            indices.append(longueur_base + i + 1)
-            indices.append(longueur_base + i + 1 + 241)
-
-        longueur_base += 241 * 2
-        for i in range(240):
-            indices.append(longueur_base + i)
-            indices.append(longueur_base + i + 1)
-            indices.append(longueur_base + i + 241)
-            indices.append(longueur_base + i + 241)
-            indices.append(longueur_base + i + 1)
-            indices.append(longueur_base + i + 1 + 241)
-
-        longueur_base += 241 * 2
-        for i in range(240):
-            indices.append(longueur_base + i)
-            indices.append(longueur_base + i + 241)
-            indices.append(longueur_base + i + 1)
-            indices.append(longueur_base + i + 1 + 241)
-            indices.append(longueur_base + i + 1)
-            indices.append(longueur_base + i + 241)
-
-        longueur_base += 241 * 2
-        for i in range(240):
-            indices.append(longueur_base + i)
-            indices.append(longueur_base + i + 241)
-            indices.append(longueur_base + i + 1)
-            indices.append(longueur_base + i + 1)
-            indices.append(longueur_base + i + 241)
-            indices.append(longueur_base + i + 1 + 241)
-        longueur_base += 241 * 2
-
-        for i in range(240):
-            for j in range(240):
-                indices.append(longueur_base + i * 241 + j)
-                indices.append(longueur_base + i * 241 + j + 1)
-                indices.append(longueur_base + (i + 1) * 241 + j + 1)
-                indices.append(longueur_base + i * 241 + j)
-                indices.append(longueur_base + (i + 1) * 241 + j + 1)
-                indices.append(longueur_base + (i + 1) * 241 + j)
-
-        longueur_base += 241 * 241
-        longueur_petit_rectangles -= longueur_base
-
-        # Rectangles extérieurs inférieurs
-
-        for i in range(30):
-            for j in range(240):
-                indices.append(longueur_base + i * 241 + j)
-                indices.append(longueur_base + i * 241 + j + 1)
-                indices.append(longueur_base + (i + 1) * 241 + j + 1)
-                indices.append(longueur_base + (i + 1) * 241 + j)
-                indices.append(longueur_base + i * 241 + j)
-                indices.append(longueur_base + (i + 1) * 241 + j + 1)
-
-        longueur_base += longueur_petit_rectangles
-        for i in range(30):
-            for j in range(240):
-                indices.append(longueur_base + (i + 1) * 241 + j + 1)
-                indices.append(longueur_base + i * 241 + j)
-                indices.append(longueur_base + i * 241 + j + 1)
-                indices.append(longueur_base + (i + 1) * 241 + j)
-                indices.append(longueur_base + i * 241 + j)
-                indices.append(longueur_base + (i + 1) * 241 + j + 1)
-
-        longueur_base += longueur_petit_rectangles
-        for i in range(240):
-            for j in range(30):
-                indices.append(longueur_base + i * 31 + j)
-                indices.append(longueur_base + i * 31 + j + 1)
-                indices.append(longueur_base + (i + 1) * 31 + j + 1)
-                indices.append(longueur_base + i * 31 + j)
-                indices.append(longueur_base + (i + 1) * 31 + j + 1)
-                indices.append(longueur_base + (i + 1) * 31 + j)
-
-        longueur_base += longueur_petit_rectangles
-        for i in range(240):
-            for j in range(30):
-                indices.append(longueur_base + i * 31 + j)
-                indices.append(longueur_base + i * 31 + j + 1)
-                indices.append(longueur_base + (i + 1) * 31 + j + 1)
-                indices.append(longueur_base + i * 31 + j)
-                indices.append(longueur_base + (i + 1) * 31 + j + 1)
-                indices.append(longueur_base + (i + 1) * 31 + j)
-
-        longueur_base += longueur_petit_rectangles
-
-        # Coins inférieurs
-        for i in range(20):
-            indices.append(longueur_base)
-            indices.append(longueur_base + i + 1)
-            indices.append(longueur_base + i)
-
-        longueur_base += 41
-        for i in range(20):
-            indices.append(longueur_base)
-            indices.append(longueur_base + i)
-            indices.append(longueur_base + i + 1)
-
-        longueur_base += 41
-        for i in range(20):
-            indices.append(longueur_base)
-            indices.append(longueur_base + i + 1)
-            indices.append(longueur_base + i)
-
-        longueur_base += 41
-        for i in range(20):
-            indices.append(longueur_base)
-            indices.append(longueur_base + i)
-            indices.append(longueur_base + i + 1)
-
-        longueur_base += 41
-
-        indices = np.array(indices, np.uint32)
-
-        mesh = Mesh(
-            shader,
-            attributes=dict(
-                position=scaled,
-                tex_coord=tex_coords,
-                normal=compute_normals(scaled, indices),
-            ),
-            index=indices,
+        # terrain arrays are generated once, then memory mapped from the cache
+        params = dict(
+            noise=[(n.octaves, n.seed) for n in FLOOR_NOISES],
+            **self.shape,
         )
+        if heightmap_shader is None:
+            arrays = mesh_cache.get("floor", params, self.build_mesh)
+            mesh = self.mesh(shader, arrays)
+            top = arrays["top"]
+        else:
+            # top and underside grids displaced on the GPU, the rest as a mesh
+            arrays = mesh_cache.get("floor-heightmap", params, self.build_heightmaps)
+            # texture repeats 6 times across the heightfield, see build_mesh
+            scale = 3 / (2 * self.size)
+            radius = border if radius is None else radius
+            half, inner = 2 * self.size, 2 * (self.size - radius)
+            top = arrays["top"]
+            mesh = Node(
+                children=[
+                    self.mesh(shader, arrays),
+                    HeightmapMesh(
+                        heightmap_shader,
+                        top,
+                        (-half, -half),
+                        (half, half),
+                        arrays["top_normal"],
+                        tex_transform=(scale, scale, 3, 3),
+                    ),
+                    # mirrored along x so that the grid faces down
+                    HeightmapMesh(
+                        heightmap_shader,
+                        arrays["under"][::-1],
+                        (inner, -inner),
+                        (-inner, inner),
+                        arrays["under_normal"][::-1],
+                        tex_transform=(scale, scale, 3, 3),
+                    ),
+                ]
+            )
+
+        # ground height queries over the top grid, in mesh coordinates
+        self.heightfield = Heightfield(top, (-2 * size,) * 2, (2 * size,) * 2)
 
         # setup & upload texture to GPU, bind it to shader name 'diffuse_map'
         texture = Texture(self.file, self.wrap, *self.filter)
@@ -811,38 +297,69 @@ class Floor(Textured):
         texture3 = Texture(self.file3, self.wrap, *self.filter)
         super().__init__(mesh, tex=texture, tex2=texture2, tex3=texture3)
 
-    def smoothStep(self, edgeLeft, edgeRight, x, y):
-        x, y = abs(x), abs(y)
-        if x < edgeLeft:
-            x = edgeLeft
-        if x > edgeRight:
-            x = edgeRight
-        if y < edgeLeft:
-            y = edgeLeft
-        if y > edgeRight:
-            y = edgeRight
-
-        tx = (x - edgeLeft) / (edgeRight - edgeLeft)
-        ty = (y - edgeLeft) / (edgeRight - edgeLeft)
-
-        if tx + ty == 0:
-            return 1
-
-        t = np.sqrt(tx * tx + ty * ty)
-
-        if t >= 1:
-            return 0
-
-        return 2 * Math.pow(t, 3) - 3 * Math.pow(t, 2) + 1
-
-    def getAltitude(self, x, y, puissance):
-        # return np.sin(x+np.cos(y))+0.5 * np.sin(2+y+np.cos(2 * x))+0.4
-        nx = x / 100
-        ny = y / 100
-        out = 2 * noise1([nx, ny])
-        out += 0.5 * noise2([nx, ny])
-        out += 0.25 * noise3([nx, ny])
-        if out <= 0:
-            return 0
-        e = out / (1 + 0.5 + 0.25)
-        return Math.pow(e, puissance)
+    @staticmethod
+    def mesh(shader, arrays):
+        """Mesh of the arrays made by build_mesh"""
+        return Mesh(
+            shader,
+            attributes=dict(
+                position=arrays["position"],
+                tex_coord=arrays["tex_coord"],
+                normal=arrays["normal"],
+            ),
+            index=arrays["index"],
+            interleaved=True,
+            formats=dict(normal="normal", tex_coord="half"),  # tex coords in [0, 6]
+        )
+
+    def build_mesh(self, heightfields=True):
+        """Positions, tex coords, normals and indices of the whole floor, plus
+        the top grid heights indexed [x, y]"""
+        positions, indices = island(
+            self.top,
+            self.bottom,
+            heightfields=heightfields,
+            workers=self.workers,
+            **self.shape,
+        )
+        # texture repeats 6 times across the heightfield, whatever its size
+        tex_coords = (positions[:, :2] + self.size) * 3 / self.size
+        scaled = 2 * positions
+        # decimated meshes mix tiny and huge triangles, area weights would
+        # let flat regions bend the normals of the hills around them
+        weighting = "area" if self.shape["tolerance"] is None else "angle"
+        span = samples(-self.size, self.size, self.shape["step"])
+        x, y = np.meshgrid(span, span, indexing="ij")
+        # reordered for the vertex cache once here, rather than at each upload
+        attributes, indices = optimize_vertex_cache(
+            dict(
+                position=scaled.astype(np.float32),
+                tex_coord=tex_coords.astype(np.float32),
+                normal=compute_normals(scaled, indices, weighting),
+            ),
+            indices,
+        )
+        return dict(
+            attributes,
+            index=indices,
+            top=(2 * evaluate(self.top, x, y, self.workers)).astype(np.float32),
+        )
+
+    def build_heightmaps(self):
+        """Floor mesh without its top and underside grids, plus the heights
+        and normals of these grids, indexed [x, y]"""
+        arrays = self.build_mesh(heightfields=False)
+        step, depth, radius = (self.shape[k] for k in ("step", "depth", "radius"))
+        radius = self.shape["border"] if radius is None else radius
+        span = samples(-self.size, self.size, step)
+        inner = samples(radius - self.size, self.size - radius, step)
+        x, y = np.meshgrid(inner, inner, indexing="ij")
+        under = 2 * (evaluate(self.bottom, x, y, self.workers) - depth)
+        spacing = (2 * (span[1] - span[0]),) * 2
+        inner_spacing = (2 * (inner[1] - inner[0]),) * 2
+        return dict(
+            arrays,
+            top_normal=heightmap_normals(arrays["top"], spacing),
+            under=under.astype(np.float32),
+            under_normal=-heightmap_normals(under, inner_spacing),
+        )
@@ -0,0 +1,71 @@
+"""
+Heightfield queries: ground height, normal and slope at any (x, y).
+Built from the terrain height grids, so that placement and collisions do not
+need to regenerate noise nor read meshes.
+"""
+# external module
+import numpy as np  # queries run on whole coordinate arrays
+
+
+class Heightfield:
+    """Regular grid of heights indexed [x, y], spread over [low, high] in xy
+    and stored as float32. Queries interpolate bilinearly on whole arrays of
+    points, points outside of the grid get nan."""
+
+    def __init__(self, heights, low, high):
+        self.heights = np.ascontiguousarray(heights, np.float32)
+        self.low = np.asarray(low, np.float64)
+        self.high = np.asarray(high, np.float64)
+        self.spacing = (self.high - self.low) / np.subtract(self.heights.shape, 1)
+
+    def _cells(self, xs, ys):
+        """Cell indices, position in cell and inside mask of the points"""
+        u = (np.asarray(xs, np.float64) - self.low[0]) / self.spacing[0]
+        v = (np.asarray(ys, np.float64) - self.low[1]) / self.spacing[1]
+        rows, cols = self.heights.shape
+        inside = (u >= 0) & (u <= rows - 1) & (v >= 0) & (v <= cols - 1)
+        i = np.clip(np.floor(np.nan_to_num(u)), 0, rows - 2).astype(np.intp)
+        j = np.clip(np.floor(np.nan_to_num(v)), 0, cols - 2).astype(np.intp)
+        return i, j, u - i, v - j, inside
+
+    def _corners(self, i, j):
+        """Heights of the four corners of cells (i, j)"""
+        h = self.heights
+        return h[i, j], h[i + 1, j], h[i, j + 1], h[i + 1, j + 1]
+
+    def contains(self, xs, ys):
+        """Whether points fall on the grid"""
+        return self._cells(xs, ys)[4]
+
+    def height_at(self, xs, ys):
+        """Interpolated heights at points (xs, ys)"""
+        i, j, fu, fv, inside = self._cells(xs, ys)
+        h00, h10, h01, h11 = self._corners(i, j)
+        low_v = h00 * (1 - fu) + h10 * fu
+        high_v = h01 * (1 - fu) + h11 * fu
+        heights = low_v * (1 - fv) + high_v * fv
+        return np.where(inside, heights, np.nan).astype(np.float32)
+
+    def gradient_at(self, xs, ys):
+        """Height derivatives (dz/dx, dz/dy) at points, stacked on last axis"""
+        i, j, fu, fv, inside = self._cells(xs, ys)
+        h00, h10, h01, h11 = self._corners(i, j)
+        dx = ((h10 - h00) * (1 - fv) + (h11 - h01) * fv) / self.spacing[0]
+        dy = ((h01 - h00) * (1 - fu) + (h11 - h10) * fu) / self.spacing[1]
+        gradient = np.stack((dx, dy), axis=-1)
+        return np.where(inside[..., None], gradient, np.nan).astype(np.float32)
+
+    def normal_at(self, xs, ys):
+        """Upward unit normals at points, stacked on last axis"""
+        gradient = self.gradient_at(xs, ys)
+        normals = np.concatenate((-gradient, np.ones_like(gradient[..., :1])), axis=-1)
+        return normals / np.linalg.norm(normals, axis=-1, keepdims=True)
+
+    def slope_at(self, xs, ys):
+        """Slope angles at points, in radians from horizontal"""
+        return np.arctan(np.linalg.norm(self.gradient_at(xs, ys), axis=-1))
+
+
+def highest(heightfields, xs, ys):
+    """Highest of several heightfields at points, nan where none covers them"""
+    return np.fmax.reduce([field.height_at(xs, ys) for field in heightfields])
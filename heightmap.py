@@ -0,0 +1,86 @@
+""" GPU heightmap displacement: flat grid meshes whose vertex shader reads
+heights and normals from float textures """
+
+import numpy as np  # all matrix manipulations & OpenGL args
+import OpenGL.GL as GL  # standard Python OpenGL wrapper
+
+from core import Mesh, VertexArray
+from texture import FloatTexture
+from transform import grid_triangles
+
+# texture units reserved for displacement, above those of Textured decorators
+HEIGHTMAP_UNIT, NORMALMAP_UNIT = 14, 15
+
+# flat grids shared by every heightmap mesh, keyed by (rows, cols)
+_grids = {}
+
+
+def flat_grid(shader, rows, cols):
+    """Shared vertex array of a rows x cols grid over [0, 1]^2. Heightmap
+    shaders bind its 'grid' attribute to location 0, so the vertex array
+    made with one of them serves all of them."""
+    if (rows, cols) not in _grids:
+        u, v = np.meshgrid(
+            np.linspace(0, 1, rows), np.linspace(0, 1, cols), indexing="ij"
+        )
+        grid = np.stack((u, v), axis=-1).reshape(-1, 2).astype(np.float32)
+        _grids[rows, cols] = VertexArray(
+            shader, dict(grid=grid), grid_triangles(rows, cols)
+        )
+    return _grids[rows, cols]
+
+
+def heightmap_normals(heights, spacing):
+    """Upward unit normals of a height array indexed [x, y], samples being
+    spacing = (dx, dy) apart"""
+    slope_x, slope_y = np.gradient(np.asarray(heights, np.float64), *spacing)
+    normals = np.stack((-slope_x, -slope_y, np.ones_like(slope_x)), axis=-1)
+    return (normals / np.linalg.norm(normals, axis=-1, keepdims=True)).astype(
+        np.float32
+    )
+
+
+class HeightmapMesh(Mesh):
+    """Heightfield drawn as a shared flat grid spread over [low, high] in xy,
+    displaced in the vertex shader by the heights texture. Grid resolution
+    defaults to the heights one, edits and resolution changes only touch
+    texture data. Swapping low and high x mirrors the grid to face down."""
+
+    def __init__(
+        self, shader, heights, low, high, normals=None, resolution=None, **uniforms
+    ):
+        self.shader = shader
+        self.uniforms = dict(extent_low=low, extent_high=high, **uniforms)
+        self.low, self.high = low, high
+        rows, cols = resolution or np.shape(heights)[:2]
+        self.vertex_array = flat_grid(shader, rows, cols)
+        self.heightmap = FloatTexture(heights)
+        self.normalmap = FloatTexture(self.normals(heights, normals))
+
+    def normals(self, heights, normals=None):
+        """Given normals, or upward ones computed from the heights"""
+        if normals is not None:
+            return normals
+        spacing = np.subtract(self.high, self.low) / np.subtract(np.shape(heights), 1)
+        return heightmap_normals(heights, spacing)
+
+    def update(self, heights, normals, x=0, y=0):
+        """Replace a block of heights and normals starting at sample (x, y)"""
+        self.heightmap.update(heights, x, y)
+        self.normalmap.update(normals, x, y)
+
+    def resize(self, heights, normals=None):
+        """Replace the whole heightfield, possibly with another resolution"""
+        self.heightmap.upload(heights)
+        self.normalmap.upload(self.normals(heights, normals))
+
+    def draw(self, primitives=GL.GL_TRIANGLES, attributes=None, **uniforms):
+        """Bind height and normal textures, then draw the displaced grid"""
+        for unit, texture in (
+            (HEIGHTMAP_UNIT, self.heightmap),
+            (NORMALMAP_UNIT, self.normalmap),
+        ):
+            GL.glActiveTexture(GL.GL_TEXTURE0 + unit)
+            GL.glBindTexture(texture.type, texture.glid)
+        uniforms.update(heightmap=HEIGHTMAP_UNIT, normalmap=NORMALMAP_UNIT)
+        super().draw(primitives, attributes, **uniforms)
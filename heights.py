@@ -0,0 +1,83 @@
+"""
+Height functions of the terrain builders, on whole coordinate arrays.
+Kept free of GL imports: worker processes unpickle them by importing this
+module, which only needs numpy and the noise module.
+"""
+# external module
+import numpy as np  # coordinates and heights are numpy arrays
+
+from noise import GradientNoise, fbm
+
+FLOOR_NOISES = (
+    GradientNoise(octaves=3, seed=4),
+    GradientNoise(octaves=6, seed=5),
+    GradientNoise(octaves=12, seed=6),
+)
+VOLCANO_NOISES = (GradientNoise(octaves=3, seed=3), GradientNoise(octaves=6, seed=2))
+
+
+# Floor ------------------------------------------------------------------------
+def smooth_step(edge_left, edge_right, x, y):
+    """Radial smoothstep falloff of the corners, x and y may be arrays"""
+    x = np.clip(np.abs(x), edge_left, edge_right)
+    y = np.clip(np.abs(y), edge_left, edge_right)
+
+    tx = (x - edge_left) / (edge_right - edge_left)
+    ty = (y - edge_left) / (edge_right - edge_left)
+
+    t = np.sqrt(tx * tx + ty * ty)
+
+    return np.where(t >= 1, 0, 2 * t**3 - 3 * t**2 + 1)
+
+
+def altitude(x, y, puissance):
+    """Altitude from three noise layers, x and y may be arrays"""
+    # return np.sin(x+np.cos(y))+0.5 * np.sin(2+y+np.cos(2 * x))+0.4
+    nx = np.asarray(x) / 100
+    ny = np.asarray(y) / 100
+    out = fbm(nx, ny, zip((2, 0.5, 0.25), FLOOR_NOISES))
+    e = np.maximum(out, 0) / (1 + 0.5 + 0.25)
+    return np.power(e, puissance)
+
+
+def top_height(x, y, size):
+    """Height of the grassy top, fading to 0 at its edges"""
+    falloff = smooth_step(size - 20, size, x, y)
+    return 10 * altitude(x, y, 0.33) * falloff
+
+
+def bottom_height(x, y, size):
+    """Height of the rock hanging under the island"""
+    falloff = smooth_step(0, size, x, y)
+    return -150 * altitude(x, y, 0.15) * falloff
+
+
+def plains_height(x, y):
+    """Height of the endless rocky plains streamed around the island, rising
+    out of the sea here and there"""
+    return 150 * altitude(np.asarray(x) / 8, np.asarray(y) / 8, 1) - 650
+
+
+# Volcano ----------------------------------------------------------------------
+def volcano_altitude(x, y, puissance, taille):
+    """Returns the altitude computed with perlin noise, x and y may be arrays"""
+    x, y = np.asarray(x), np.asarray(y)
+    border = (
+        (x - taille >= taille - 1)
+        | (y - taille >= taille - 1)
+        | (x - taille <= -taille + 1)
+        | (y - taille <= -taille + 1)
+    )
+    nx = x / 100
+    ny = y / 100
+    out = fbm(nx, ny, zip((4, 3), VOLCANO_NOISES))
+    out = np.where(out <= 0, out, np.power(np.maximum(out, 0), puissance))
+    return np.where(border, 0, out)
+
+
+def cone(x_pos, y_pos, taille):
+    """Volcano height: an analytic cone plus noise, x and y may be arrays"""
+    distance = 0.4 * (np.sqrt(y_pos**2 + x_pos**2)) ** 2
+    return 5000 * distance / (1500 + distance**2) + 2 * volcano_altitude(
+        x_pos + taille, y_pos + taille, 0.01, taille
+    )
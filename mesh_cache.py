@@ -0,0 +1,152 @@
+"""
+On-disk cache of generated terrain meshes.
+Arrays are stored as .npy files and memory mapped back on warm starts.
+"""
+# Python built-in modules
+import functools  # partial height functions are described by their parts
+import hashlib  # cache keys are digests of the generator parameters
+import inspect  # source of builders and formulas is part of the key
+import os  # cache directory handling
+import shutil  # entry removal
+import tempfile  # entries are written aside, then moved in place
+
+# external module
+import numpy as np  # arrays are saved and memory mapped with numpy
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(ROOT, ".cache", "meshes")
+CACHE_VERSION = 1  # bump to invalidate every entry after a format change
+CACHE_MAX_BYTES = 512 * 2**20
+
+
+def _describe(value):
+    """Stable text for a key parameter, functions are described by their source"""
+    if isinstance(value, functools.partial):
+        return _describe((value.func, value.args, value.keywords))
+    if callable(value):
+        try:
+            return value.__qualname__ + inspect.getsource(value)
+        except (OSError, TypeError):
+            return getattr(value, "__qualname__", repr(value))
+    if isinstance(value, dict):
+        return repr(sorted((k, _describe(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return repr([_describe(v) for v in value])
+    return repr(value)
+
+
+def _dependencies(module, found):
+    """Source files of the project modules module uses, recursively"""
+    for value in list(vars(module).values()):
+        used = value if inspect.ismodule(value) else inspect.getmodule(value)
+        path = getattr(used, "__file__", None)
+        if path and path.startswith(ROOT + os.sep) and path not in found:
+            if "site-packages" not in path:
+                found.add(path)
+                _dependencies(used, found)
+    return found
+
+
+class MeshCache:
+    """Memory mapped mesh arrays, keyed by a hash of their generator parameters
+    and evicted least recently used first when exceeding max_bytes"""
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, name, params, build=None):
+        """Hash of name, parameters, cache version and builder source files"""
+        digest = hashlib.sha1(f"{name}:{CACHE_VERSION}".encode())
+        digest.update(_describe(params).encode())
+        # code version: terrain generation modules, the builder's own module
+        # and every project module it depends on
+        sources = {os.path.join(ROOT, "noise.py"), os.path.join(ROOT, "transform.py")}
+        if build is not None:
+            sources.add(inspect.getsourcefile(build))
+            module = inspect.getmodule(build)
+            if module is not None:
+                _dependencies(module, sources)
+        for source in sorted(s for s in sources if s and os.path.exists(s)):
+            with open(source, "rb") as file:
+                digest.update(file.read())
+        return f"{name}-{digest.hexdigest()[:16]}"
+
+    def load(self, key):
+        """Dict of read only memory mapped arrays for key, None if not cached"""
+        path = os.path.join(self.directory, key)
+        if not os.path.isdir(path):
+            return None
+        try:
+            arrays = {
+                file[:-4]: np.load(os.path.join(path, file), mmap_mode="r")
+                for file in os.listdir(path)
+                if file.endswith(".npy")
+            }
+        except (OSError, ValueError):
+            self.invalidate(key)  # truncated or corrupted entry
+            return None
+        os.utime(path)  # mark as recently used for eviction
+        return arrays
+
+    def store(self, key, arrays):
+        """Save a dict of arrays under key, then evict old entries if needed"""
+        os.makedirs(self.directory, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=".tmp-", dir=self.directory)
+        for name, array in arrays.items():
+            np.save(os.path.join(staging, name + ".npy"), np.asarray(array))
+        try:
+            os.replace(staging, os.path.join(self.directory, key))
+        except OSError:  # another process stored the same entry meanwhile
+            shutil.rmtree(staging, ignore_errors=True)
+        self.evict(keep=key)
+
+    def get(self, name, params, build):
+        """Cached arrays for these parameters, calling build() on a miss"""
+        key = self.key(name, params, build)
+        arrays = self.load(key)
+        if arrays is None:
+            arrays = build()
+            try:
+                self.store(key, arrays)
+            except OSError:  # read only or full disk: run without cache
+                return arrays
+            arrays = self.load(key) or arrays
+        return arrays
+
+    def invalidate(self, key):
+        """Remove one cache entry"""
+        shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+
+    def clear(self):
+        """Remove every cache entry"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def entries(self):
+        """(last use time, size in bytes, key) of every entry, oldest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for key in os.listdir(self.directory):
+            path = os.path.join(self.directory, key)
+            if key.startswith(".") or not os.path.isdir(path):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(path, file)) for file in os.listdir(path)
+            )
+            entries.append((os.path.getmtime(path), size, key))
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key != keep:
+                self.invalidate(key)
+                total -= size
+
+
+mesh_cache = MeshCache()
@@ -0,0 +1,59 @@
+"""
+Vectorized gradient noise used by the terrain builders.
+Evaluates whole numpy coordinate arrays at once instead of one vertex per call.
+"""
+# Python built-in modules
+import random  # lattice gradients are drawn like perlin_noise does
+
+# external module
+import numpy as np  # coordinates and results are numpy arrays
+
+
+def fade(t):
+    """Perlin quintic smoothing of [0, 1] values"""
+    return t * t * t * (t * (6 * t - 15) + 10)
+
+
+class GradientNoise:
+    """2D gradient noise, array counterpart of perlin_noise.PerlinNoise.
+    Lattice gradients are seeded exactly like PerlinNoise, so that
+    GradientNoise(octaves, seed) reproduces PerlinNoise(octaves, seed)."""
+
+    def __init__(self, octaves=1, seed=None):
+        if octaves <= 0:
+            raise ValueError("octaves expected to be positive number")
+        self.octaves = octaves
+        self.seed = seed if seed else random.randint(1, 10**5)
+        self.gradients = {}  # lattice hash -> gradient, drawn once per hash
+
+    def _lookup(self, hashes):
+        """Gradient vectors for an array of lattice hashes"""
+        keys, inverse = np.unique(hashes, return_inverse=True)
+        for key in keys.tolist():
+            if key not in self.gradients:
+                rand = random.Random(self.seed * key)
+                self.gradients[key] = (rand.uniform(-1, 1), rand.uniform(-1, 1))
+        table = np.array([self.gradients[key] for key in keys.tolist()])
+        return table[inverse.reshape(hashes.shape)]
+
+    def __call__(self, x, y):
+        """Noise value at coordinates (x, y), scalars or broadcastable arrays"""
+        x = np.asarray(x, np.float64) * self.octaves
+        y = np.asarray(y, np.float64) * self.octaves
+        x0, y0 = np.floor(x), np.floor(y)
+        result = np.zeros(np.broadcast(x, y).shape)
+        for dx in (0, 1):
+            for dy in (0, 1):
+                corner_x, corner_y = x0 + dx, y0 + dy
+                hashes = np.maximum(1, np.abs(corner_x + 10 * corner_y + 1))
+                gradient = self._lookup(hashes.astype(np.int64))
+                dist_x, dist_y = x - corner_x, y - corner_y
+                weight = fade(1 - np.abs(dist_x)) * fade(1 - np.abs(dist_y))
+                dot = gradient[..., 0] * dist_x + gradient[..., 1] * dist_y
+                result += weight * dot
+        return result if result.ndim else float(result)
+
+
+def fbm(x, y, layers):
+    """Fractal sum of (amplitude, noise) layers at coordinates (x, y)"""
+    return sum(amplitude * noise(x, y) for amplitude, noise in layers)
@@ -0,0 +1,83 @@
+"""
+Process pool evaluation of terrain height functions by row bands.
+Workers write their band straight into one shared memory result buffer.
+"""
+# Python built-in modules
+import multiprocessing  # worker processes start fresh, not forked from GL
+import os  # default worker count
+from concurrent.futures import ProcessPoolExecutor  # worker processes
+from multiprocessing import shared_memory  # result buffer shared by workers
+
+# external module
+import numpy as np  # coordinates and results are numpy arrays
+
+MIN_BAND_SIZE = 4096  # smaller bands cost more to ship than to compute
+
+
+_pool, _pool_size = None, 0  # worker processes shared by every evaluation
+
+
+def _workers(count):
+    """The shared pool, restarted with count workers if it has fewer"""
+    global _pool, _pool_size
+    if _pool_size < count:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = ProcessPoolExecutor(
+            count, mp_context=multiprocessing.get_context("spawn")
+        )
+        _pool_size = count
+    return _pool
+
+
+def _evaluate_band(function, x, y, name, shape, start, stop):
+    """Worker side: evaluate one band and write it in the shared result"""
+    memory = shared_memory.SharedMemory(name=name)
+    try:
+        result = np.ndarray(shape, np.float64, buffer=memory.buf)
+        result[start:stop] = function(x, y)
+        del result  # release the buffer before closing the mapping
+    finally:
+        memory.close()
+
+
+def evaluate(function, x, y, workers=1):
+    """function(x, y) on broadcastable arrays, split in bands along the first
+    axis and evaluated by a pool of workers processes (all cores if None).
+    Workers are spawned, not forked from a process holding a GL context,
+    and kept for the next calls.
+    function must be picklable, e.g. a module function or a partial of one,
+    and elementwise: every value then goes through the same operations as in
+    the serial call, so that results are bit identical to it."""
+    x, y = np.broadcast_arrays(np.asarray(x, np.float64), np.asarray(y, np.float64))
+    workers = workers or os.cpu_count()
+    bands = min(workers, x.size // MIN_BAND_SIZE, len(x) if x.ndim else 0)
+    if bands <= 1:
+        return function(x, y)
+
+    bounds = np.linspace(0, len(x), bands + 1).astype(int)
+    memory = shared_memory.SharedMemory(create=True, size=x.nbytes)
+    try:
+        pool = _workers(bands)
+        jobs = [
+            pool.submit(
+                _evaluate_band,
+                function,
+                x[start:stop],
+                y[start:stop],
+                memory.name,
+                x.shape,
+                start,
+                stop,
+            )
+            for start, stop in zip(bounds[:-1], bounds[1:])
+        ]
+        for job in jobs:
+            job.result()  # re-raise worker errors
+        result = np.ndarray(x.shape, np.float64, buffer=memory.buf)
+        heights = result.copy()  # own the data before the buffer goes away
+        del result
+        return heights
+    finally:
+        memory.close()
+        memory.unlink()
@@ -0,0 +1,63 @@
+"""
+On-disk cache of linked shader program binaries.
+Binaries only fit the driver that made them: keys hash the sources together
+with the GL vendor, renderer and version strings.
+"""
+# Python built-in modules
+import hashlib  # cache keys are digests of sources and driver strings
+import os  # cache directory handling
+import struct  # binary format header
+import tempfile  # entries are written aside, then moved in place
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(ROOT, ".cache", "programs")
+HEADER = struct.Struct("<I")  # GL binary format enum, before the binary
+
+
+class ProgramCache:
+    """Program binaries and their GL format, one file per program"""
+
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+
+    @staticmethod
+    def key(sources, driver):
+        """Hash of the program sources and of the driver description strings"""
+        digest = hashlib.sha1()
+        for text in (*driver, *sources):
+            digest.update(text.encode() if isinstance(text, str) else text)
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def load(self, key):
+        """(binary format, binary bytes) stored under key, None if not cached"""
+        try:
+            with open(os.path.join(self.directory, key + ".bin"), "rb") as file:
+                data = file.read()
+        except OSError:
+            return None
+        if len(data) <= HEADER.size:
+            self.invalidate(key)  # truncated entry
+            return None
+        return HEADER.unpack_from(data)[0], data[HEADER.size :]
+
+    def store(self, key, binary_format, binary):
+        """Save a program binary under key, silently skipped if not writable"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            handle, staging = tempfile.mkstemp(prefix=".tmp-", dir=self.directory)
+            with os.fdopen(handle, "wb") as file:
+                file.write(HEADER.pack(binary_format) + bytes(binary))
+            os.replace(staging, os.path.join(self.directory, key + ".bin"))
+        except OSError:  # read only or full disk: run without cache
+            pass
+
+    def invalidate(self, key):
+        """Remove one cache entry, e.g. a binary the driver rejected"""
+        try:
+            os.remove(os.path.join(self.directory, key + ".bin"))
+        except OSError:
+            pass
+
+
+program_cache = ProgramCache()
@@ -0,0 +1,51 @@
+"""
+On-disk cache of imported model scenes.
+The post-processed vertex arrays, bone data and keyframes of a model file
+are stored as .npy files and memory mapped back on warm starts, the node
+hierarchy and materials as JSON text in one more array.
+"""
+# Python built-in modules
+import hashlib  # cache keys are digests of the file identity
+import json  # scene description
+import os  # file identity and cache directory
+
+# external module
+import numpy as np  # scene description is stored as an array of bytes
+
+from mesh_cache import ROOT, MeshCache
+
+CACHE_DIR = os.path.join(ROOT, ".cache", "scenes")
+CACHE_VERSION = 1  # bump to invalidate every entry after a format change
+
+
+def describe(description):
+    """Array holding a JSON scene description"""
+    return np.frombuffer(json.dumps(description).encode(), np.uint8)
+
+
+def description(arrays):
+    """Scene description stored by describe"""
+    return json.loads(bytes(arrays["scene"]).decode())
+
+
+class SceneCache(MeshCache):
+    """Memory mapped scene arrays, keyed by model file path, modification
+    time and size, and by the import options"""
+
+    def __init__(self, directory=CACHE_DIR):
+        super().__init__(directory)
+
+    def key(self, name, params, build=None):
+        """Hash of the file identity, parameters and cache version"""
+        digest = hashlib.sha1(f"{name}:{CACHE_VERSION}:{params!r}".encode())
+        return f"{os.path.basename(name)}-{digest.hexdigest()[:16]}"
+
+    def get_scene(self, file, build, options=()):
+        """Arrays of the scene of a model file, build(file) on misses only.
+        The cache entry is replaced whenever the file changes."""
+        stat = os.stat(file)
+        params = (tuple(options), stat.st_mtime_ns, stat.st_size)
+        return self.get(os.path.abspath(file), params, lambda: build(file))
+
+
+scene_cache = SceneCache()
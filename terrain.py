@@ -0,0 +1,352 @@
+""" Chunked terrain with distance based level of detail """
+
+import multiprocessing  # worker processes start fresh, not forked from GL
+import queue  # generated chunks wait here for the GL thread
+import time  # upload budget per frame
+from collections import OrderedDict  # least recently used chunk meshes
+from concurrent.futures import ProcessPoolExecutor  # background chunk workers
+from functools import partial
+
+import numpy as np  # all matrix manipulations & OpenGL args
+import OpenGL.GL as GL  # standard Python OpenGL wrapper
+
+from core import Mesh
+from transform import compact_index_type, grid_triangles, identity
+
+# children of a chunk, as (x, y) sign multipliers of their center offset
+QUARTERS = ((-1, -1), (1, -1), (-1, 1), (1, 1))
+
+
+def chunk_arrays(height, center, half, resolution=33, skirt=0.1, tex_period=50):
+    """Vertex attributes and indices of a square terrain tile of half width
+    'half' around center, sampled over resolution^2 heights of height(x, y).
+    Its border gets a skirt dropping skirt * half to hide cracks between
+    neighbors of different resolution."""
+    step = 2 * half / (resolution - 1)
+    # one extra sample on each side gives normals that match across tiles
+    axis = np.arange(-1, resolution + 1) * step - half
+    x, y = np.meshgrid(center[0] + axis, center[1] + axis, indexing="ij")
+    z = height(x, y)
+    slope_x = (z[2:, 1:-1] - z[:-2, 1:-1]) / (2 * step)
+    slope_y = (z[1:-1, 2:] - z[1:-1, :-2]) / (2 * step)
+    normals = np.stack((-slope_x, -slope_y, np.ones_like(slope_x)), axis=-1)
+    normals = normals.reshape(-1, 3) / np.linalg.norm(normals, axis=-1).reshape(-1, 1)
+    positions = np.stack((x, y, z), axis=-1)[1:-1, 1:-1].reshape(-1, 3)
+
+    # skirt hanging below the border loop, counter clockwise seen from above
+    grid = np.arange(resolution * resolution).reshape(resolution, resolution)
+    loop = np.concatenate(
+        (grid[-1, :-1], grid[:0:-1, -1], grid[0, :0:-1], grid[:-1, 0])
+    )
+    bottom = len(positions) + np.arange(len(loop))
+    top_next, bottom_next = np.roll(loop, -1), np.roll(bottom, -1)
+    skirt_triangles = np.column_stack(
+        (loop, bottom, top_next, top_next, bottom, bottom_next)
+    ).reshape(-1, 3)
+
+    positions = np.vstack((positions, positions[loop] - (0, 0, skirt * half)))
+    normals = np.vstack((normals, normals[loop]))
+    index = np.vstack((grid_triangles(resolution, resolution), skirt_triangles))
+    return dict(
+        position=positions.astype(np.float32),
+        normal=normals.astype(np.float32),
+        tex_coord=(positions[:, :2] / tex_period).astype(np.float32),
+        index=index.astype(compact_index_type(len(positions))),
+    )
+
+
+class Chunk:
+    """Square tile of the terrain quadtree, children cover its four quarters
+    with the same number of vertices, i.e. twice its resolution"""
+
+    def __init__(self, center, half, depth, heights=(0, 0)):
+        self.center = np.asarray(center, np.float64)
+        self.half = half
+        self.depth = depth
+        self.children = []
+        self.mesh = None  # GPU data, uploaded once generated
+        # bounding box corners, heights of the parent chunk until generated
+        self.low = np.append(self.center - half, heights[0])
+        self.high = np.append(self.center + half, heights[1])
+        self.triangles = 0
+
+    def place(self, arrays):
+        """Bounding box and triangle count from the generated arrays"""
+        position = arrays["position"]
+        self.low, self.high = position.min(axis=0), position.max(axis=0)
+        self.triangles = len(arrays["index"])
+
+    def distance(self, eye):
+        """Distance from point eye to the chunk bounding box"""
+        outside = np.maximum(self.low - eye, eye - self.high)
+        return np.linalg.norm(np.maximum(outside, 0))
+
+    def split(self):
+        """The four chunks covering the quarters of this one"""
+        if not self.children:
+            quarter = self.half / 2
+            heights = (self.low[2], self.high[2])
+            self.children = [
+                Chunk(
+                    self.center + quarter * np.array(sign),
+                    quarter,
+                    self.depth + 1,
+                    heights,
+                )
+                for sign in QUARTERS
+            ]
+        return self.children
+
+    def draw(self, primitives, **uniforms):
+        """Draw the chunk mesh"""
+        self.mesh.draw(primitives, **uniforms)
+
+
+class ChunkedTerrain:
+    """Terrain over [-size, size]^2 split in a quadtree of chunks. Chunks are
+    refined while the camera is closer than lod_distance times their width,
+    down to max_depth, so that the drawn triangle count depends on the view
+    and not on the map size. Chunks are generated by a pool of worker
+    processes and uploaded by the GL thread for at most upload_budget
+    seconds per frame, a chunk is drawn until its four children are all
+    uploaded. Besides the chunks visited by the last frame, at most
+    cache_size chunk meshes are kept, the least recently drawn ones
+    have their buffers refilled for new chunks. height(x, y) must be
+    picklable and work on whole arrays."""
+
+    def __init__(
+        self,
+        shader,
+        height,
+        size,
+        max_depth=4,
+        resolution=33,
+        lod_distance=2.0,
+        skirt=0.1,
+        tex_period=50,
+        workers=None,
+        upload_budget=0.004,
+        cache_size=64,
+    ):
+        self.shader = shader
+        self.height = height
+        self.max_depth = max_depth
+        self.lod_distance = lod_distance
+        self.options = dict(resolution=resolution, skirt=skirt, tex_period=tex_period)
+        self.upload_budget = upload_budget
+        self.pool = ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        self.pending = {}  # futures of chunks being generated, by chunk
+        self.finished = queue.Queue()  # (chunk, future) of generated chunks
+        self.cache_size = cache_size
+        self.meshes = OrderedDict()  # chunks with a mesh, least recently used first
+        self.visited = set()  # chunks drawn or refined by the last frame
+        self.root = Chunk((0, 0), size, 0)
+        self.drawn = (0, 0)  # chunks and triangles of the last frame
+        self.stats = dict(uploaded=0, reused=0)
+
+    def select(self, eye):
+        """Uploaded chunks to draw for a camera at eye, in terrain coordinates,
+        the chunks to generate to refine them, and all the chunks visited"""
+        if self.root.mesh is None:
+            return [], [self.root], set()
+        selected, missing, visited, stack = [], [], set(), [self.root]
+        while stack:
+            chunk = stack.pop()
+            visited.add(chunk)
+            near = chunk.distance(eye) < self.lod_distance * 2 * chunk.half
+            if near and chunk.depth < self.max_depth:
+                children = chunk.split()
+                if all(child.mesh is not None for child in children):
+                    stack.extend(children)
+                    continue
+                missing += [child for child in children if child.mesh is None]
+            selected.append(chunk)
+        return selected, missing, visited
+
+    def request(self, chunks):
+        """Generate missing chunks, cancel those not started and not needed"""
+        for chunk in [c for c in self.pending if c not in chunks]:
+            if self.pending[chunk].cancel():
+                del self.pending[chunk]
+        for chunk in chunks:
+            if chunk not in self.pending:
+                future = self.pool.submit(
+                    chunk_arrays,
+                    self.height,
+                    chunk.center.tolist(),
+                    chunk.half,
+                    **self.options,
+                )
+                future.add_done_callback(partial(self._queue, chunk))
+                self.pending[chunk] = future
+
+    def _queue(self, chunk, future):
+        """Worker done callback, hands the chunk over to the GL thread"""
+        if not future.cancelled():
+            self.finished.put((chunk, future))
+
+    def upload(self):
+        """Upload generated chunks, within the frame budget"""
+        start, uploaded = time.perf_counter(), 0
+        while not uploaded or time.perf_counter() - start < self.upload_budget:
+            try:
+                chunk, future = self.finished.get_nowait()
+            except queue.Empty:
+                break
+            del self.pending[chunk]
+            arrays = future.result()
+            chunk.place(arrays)
+            chunk.mesh = self.mesh(arrays)
+            self.meshes[chunk] = None
+            uploaded += 1
+        self.stats["uploaded"] += uploaded
+
+    def mesh(self, arrays):
+        """Mesh of chunk arrays, refilling the least recently used chunk
+        mesh not visited by the last frame when the cache is full. Ancestors
+        of drawn chunks are visited, so coarsening never waits for them."""
+        attributes = {k: v for k, v in arrays.items() if k != "index"}
+        cached = [chunk for chunk in self.meshes if chunk not in self.visited]
+        if len(cached) < max(self.cache_size, 1):
+            return Mesh(self.shader, attributes, arrays["index"], interleaved=True)
+        # every chunk has the same vertex count and index buffer
+        evicted = cached[0]
+        mesh, evicted.mesh = evicted.mesh, None
+        del self.meshes[evicted]
+        mesh.vertex_array.update(attributes)
+        self.stats["reused"] += 1
+        return mesh
+
+    def draw(self, primitives=GL.GL_TRIANGLES, model=identity(), **uniforms):
+        """Draw the chunks selected from the camera position, refining them
+        as their children get generated"""
+        camera = uniforms.get("w_camera_position", (0, 0, 0))
+        eye = (np.linalg.inv(model) @ np.append(camera, 1))[:3]
+        self.upload()
+        chunks, missing, self.visited = self.select(eye)
+        self.request(set(missing))
+        for chunk in self.visited:
+            self.meshes.move_to_end(chunk)
+        for chunk in chunks:
+            chunk.draw(primitives, model=model, **uniforms)
+        self.drawn = (len(chunks), sum(chunk.triangles for chunk in chunks))
+
+    def close(self):
+        """Stop the workers, dropping chunks not generated yet"""
+        self.pool.shutdown(cancel_futures=True)
+
+
+class StreamingTerrain:
+    """Endless terrain of square chunks of width chunk_size, drawn within
+    radius chunks of the camera. Missing chunks are generated by a pool of
+    worker processes, queued back and uploaded by the GL thread for at most
+    upload_budget seconds per frame (at least one chunk, so that it keeps
+    up). Chunks leaving the ring are kept in a least recently used cache of
+    cache_size meshes, whose buffers are refilled for new chunks instead of
+    being deleted. height(x, y) must be picklable and work on whole arrays."""
+
+    def __init__(
+        self,
+        shader,
+        height,
+        chunk_size=200,
+        radius=4,
+        resolution=33,
+        skirt=0.1,
+        tex_period=50,
+        workers=None,
+        upload_budget=0.004,
+        cache_size=16,
+    ):
+        self.shader = shader
+        self.height = height
+        self.chunk_size = chunk_size
+        self.radius = radius
+        self.options = dict(resolution=resolution, skirt=skirt, tex_period=tex_period)
+        self.upload_budget = upload_budget
+        self.cache_size = cache_size
+        self.pool = ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        self.pending = {}  # futures of chunks being generated, by key
+        self.finished = queue.Queue()  # (key, future) of generated chunks
+        self.meshes = OrderedDict()  # uploaded chunks, least recently used first
+        self.active = set()  # keys of the chunks in the ring
+        self.stats = dict(uploaded=0, reused=0, dropped=0)
+
+    def ring(self, eye):
+        """Keys (i, j) of the chunks within radius of the camera, nearest first"""
+        cx, cy = np.floor(np.asarray(eye[:2]) / self.chunk_size).astype(int)
+        steps = np.arange(-self.radius, self.radius + 1)
+        di, dj = (d.ravel() for d in np.meshgrid(steps, steps, indexing="ij"))
+        distance = di * di + dj * dj
+        order = np.argsort(distance, kind="stable")
+        order = order[distance[order] <= self.radius**2]
+        return [(cx + int(di[k]), cy + int(dj[k])) for k in order]
+
+    def request(self, keys):
+        """Generate missing chunks, cancel those not started and out of ring"""
+        for key in [k for k in self.pending if k not in self.active]:
+            if self.pending[key].cancel():
+                del self.pending[key]
+        for key in keys:
+            if key not in self.meshes and key not in self.pending:
+                center = (np.add(key, 0.5) * self.chunk_size).tolist()
+                half = self.chunk_size / 2
+                future = self.pool.submit(
+                    chunk_arrays, self.height, center, half, **self.options
+                )
+                future.add_done_callback(partial(self._queue, key))
+                self.pending[key] = future
+
+    def _queue(self, key, future):
+        """Worker done callback, hands the chunk over to the GL thread"""
+        if not future.cancelled():
+            self.finished.put((key, future))
+
+    def upload(self):
+        """Upload generated chunks still in the ring, within the frame budget"""
+        start, uploaded = time.perf_counter(), 0
+        while not uploaded or time.perf_counter() - start < self.upload_budget:
+            try:
+                key, future = self.finished.get_nowait()
+            except queue.Empty:
+                break
+            del self.pending[key]
+            if key not in self.active:  # camera moved on while generating
+                self.stats["dropped"] += 1
+                continue
+            self.meshes[key] = self.mesh(future.result())
+            uploaded += 1
+        self.stats["uploaded"] += uploaded
+
+    def mesh(self, arrays):
+        """Mesh of chunk arrays, refilling the least recently used cached
+        chunk buffers when the cache is full"""
+        attributes = {k: v for k, v in arrays.items() if k != "index"}
+        cached = [key for key in self.meshes if key not in self.active]
+        if len(cached) < max(self.cache_size, 1):
+            return Mesh(self.shader, attributes, arrays["index"], interleaved=True)
+        # every chunk has the same vertex count and index buffer
+        mesh = self.meshes.pop(cached[0])
+        mesh.vertex_array.update(attributes)
+        self.stats["reused"] += 1
+        return mesh
+
+    def draw(self, primitives=GL.GL_TRIANGLES, model=identity(), **uniforms):
+        """Stream the chunks around the camera, then draw those uploaded"""
+        camera = uniforms.get("w_camera_position", (0, 0, 0))
+        eye = (np.linalg.inv(model) @ np.append(camera, 1))[:3]
+        keys = self.ring(eye)
+        self.active = set(keys)
+        self.request(keys)
+        self.upload()
+        for key in (k for k in keys if k in self.meshes):
+            self.meshes.move_to_end(key)
+            self.meshes[key].draw(primitives, model=model, **uniforms)
+
+    def close(self):
+        """Stop the workers, dropping chunks not generated yet"""
+        self.pool.shutdown(cancel_futures=True)
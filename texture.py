@@ -1,33 +1,133 @@
 """Texture module"""
 
+import os  # texture files are shared by absolute path
+import weakref  # shared GL objects live as long as their users
+from concurrent.futures import ThreadPoolExecutor  # images decode in parallel
+
+import numpy as np  # float texture data
 import OpenGL.GL as GL  # standard Python OpenGL wrapper
-from PIL import Image  # load texture maps
+
+# decoded, mipmapped images on disk
+from texture_cache import mip_chain, texture_cache
+
+
+# -------------- Image decoding ------------------------------------------------
+# PIL releases the GIL while decoding, so threads decode images concurrently
+_decoder = ThreadPoolExecutor(thread_name_prefix="texture-decode")
+_decoding = {}  # decodes in flight or done, by (path, mode, mipmaps, compressed)
+COMPRESS = False  # block compress Texture images, when the GPU supports S3TC
+S3TC = "GL_EXT_texture_compression_s3tc"
+CHANNELS = {'RGB': GL.GL_RGB, 'RGBA': GL.GL_RGBA}
+
+# texture budget, set before textures are created: largest uploaded side
+# (None for full resolution), per file overrides of it, sampler LOD bias
+MAX_SIZE = None
+SIZE_OVERRIDES = {}  # image file -> largest side, None for full resolution
+MIP_BIAS = 0.0
+_uploads = weakref.WeakSet()  # live uploads, for the memory report
+
+
+def max_size(tex_file):
+    """Largest side allowed for an image file by the texture budget"""
+    overrides = {os.path.abspath(name): size for name, size in SIZE_OVERRIDES.items()}
+    return overrides.get(os.path.abspath(tex_file), MAX_SIZE)
+
+
+def within_budget(sizes, tex_file):
+    """Index of the first mip level whose sides fit the texture budget"""
+    limit = max_size(tex_file)
+    first = 0
+    while limit and first < len(sizes) - 1 and max(sizes[first]) > limit:
+        first += 1
+    return first
+
+
+def memory_report():
+    """Print the GPU memory of live textures, at full resolution and within
+    the texture budget"""
+    full = sum(upload.full_bytes for upload in _uploads)
+    used = sum(upload.nbytes for upload in _uploads)
+    print(f'Texture memory: {full / 2**20:.1f} MB at full resolution, '
+          f'{used / 2**20:.1f} MB within budget')
+
+
+def prefetch(tex_files, mode='RGBA', mipmaps=True):
+    """Start decoding image files on the thread pool, so that textures later
+    created from them only have to upload. Decoded mip chains are cached on
+    disk, warm starts only map them. Cube map faces use mode 'RGB' and no
+    mipmaps. Call once the GL context exists, compression depends on it."""
+    compressed = _compressed(mode)
+    for tex_file in tex_files:
+        key = (os.path.abspath(tex_file), mode, mipmaps, compressed)
+        uploaded = (key[0], int(GL.GL_TEXTURE_2D), mode) in TextureImage.images
+        if key not in _decoding and not uploaded:
+            _decoding[key] = _decoder.submit(texture_cache.get_levels, *key)
+
+
+def decoded(tex_file, mode='RGBA', mipmaps=True, compressed=False):
+    """(GL compressed format or None, level sizes, level arrays) of an image
+    file, from a prefetch if any. Raises FileNotFoundError for missing files."""
+    key = (os.path.abspath(tex_file), mode, mipmaps, compressed)
+    future = _decoding.pop(key, None)
+    return future.result() if future else texture_cache.get_levels(*key)
+
+
+_extensions = []  # names of the GL context extensions, read on first query
+
+
+def _has_extension(name):
+    """Whether the GL context exposes an extension"""
+    if not _extensions:
+        count = GL.glGetIntegerv(GL.GL_NUM_EXTENSIONS)
+        _extensions.extend(GL.glGetStringi(GL.GL_EXTENSIONS, i) for i in range(count))
+    return name.encode() in _extensions
+
+
+def _compressed(mode):
+    """Whether Texture images of mode are uploaded block compressed"""
+    return COMPRESS and mode == 'RGBA' and _has_extension(S3TC)
 
 
 # -------------- OpenGL Texture Wrapper ---------------------------------------
-class Texture:
-    """ Helper class to create and automatically destroy textures """
+class TextureImage:
+    """ Image file decoded and uploaded once, with its mipmaps, then shared by
+    every Texture of the same file and format whatever their sampling """
+
+    images = weakref.WeakValueDictionary()  # live uploads by (path, type, format)
 
-    def __init__(self, tex_file, wrap_mode=GL.GL_REPEAT,
-                 mag_filter=GL.GL_LINEAR, min_filter=GL.GL_LINEAR_MIPMAP_LINEAR,
-                 tex_type=GL.GL_TEXTURE_2D):
+    def __new__(cls, tex_file, tex_type=GL.GL_TEXTURE_2D, mode='RGBA'):
+        key = (os.path.abspath(tex_file), int(tex_type), mode)
+        image = cls.images.get(key)
+        if image is None:
+            image = super().__new__(cls)
+            image.upload(tex_file, tex_type, mode)
+            cls.images[key] = image
+        return image
+
+    def upload(self, tex_file, tex_type, mode):
         self.glid = GL.glGenTextures(1)
         self.type = tex_type
         try:
-            # imports image as a numpy array in exactly right format
-            tex = Image.open(tex_file).convert('RGBA')
+            # mip chain decoded from the file or mapped from the disk cache
+            gl_format, sizes, levels = decoded(tex_file, mode, True,
+                                               _compressed(mode))
+            self.full_bytes = sum(data.nbytes for data in levels)
+            # budget: the largest levels are skipped, smaller ones move up
+            first = within_budget(sizes, tex_file)
+            sizes, levels = sizes[first:], levels[first:]
+            self.nbytes = sum(data.nbytes for data in levels)
+            _uploads.add(self)
             GL.glBindTexture(tex_type, self.glid)
-            GL.glTexImage2D(tex_type, 0, GL.GL_RGBA, tex.width, tex.height,
-                            0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, tex.tobytes())
-            GL.glTexParameteri(tex_type, GL.GL_TEXTURE_WRAP_S, wrap_mode)
-            GL.glTexParameteri(tex_type, GL.GL_TEXTURE_WRAP_T, wrap_mode)
-            GL.glTexParameteri(tex_type, GL.GL_TEXTURE_MIN_FILTER, min_filter)
-            GL.glTexParameteri(tex_type, GL.GL_TEXTURE_MAG_FILTER, mag_filter)
-            GL.glGenerateMipmap(tex_type)
-            print(f'Loaded texture {tex_file} ({tex.width}x{tex.height}'
-                  f' wrap={str(wrap_mode).split()[0]}'
-                  f' min={str(min_filter).split()[0]}'
-                  f' mag={str(mag_filter).split()[0]})')
+            for level, ((width, height), data) in enumerate(zip(sizes, levels)):
+                if gl_format:
+                    GL.glCompressedTexImage2D(tex_type, level, gl_format, width,
+                                              height, 0, data.nbytes, data)
+                else:
+                    GL.glTexImage2D(tex_type, level, CHANNELS[mode], width, height,
+                                    0, CHANNELS[mode], GL.GL_UNSIGNED_BYTE, data)
+            width, height = sizes[0]
+            skipped = f', {first} levels skipped' if first else ''
+            print(f'Loaded texture {tex_file} ({width}x{height}{skipped})')
             GL.glBindTexture(self.type, 0)
         except FileNotFoundError:
             print("ERROR: unable to load texture file %s" % tex_file)
@@ -36,21 +136,80 @@ class Texture:
         GL.glDeleteTextures(self.glid)
 
 
+class Sampler:
+    """ Shared sampler object holding wrap and filter state apart from images """
+
+    samplers = weakref.WeakValueDictionary()  # live samplers by parameters
+
+    def __new__(cls, wrap_mode, mag_filter, min_filter):
+        key = (int(wrap_mode), int(mag_filter), int(min_filter), MIP_BIAS)
+        sampler = cls.samplers.get(key)
+        if sampler is None:
+            sampler = super().__new__(cls)
+            sampler.glid = GL.glGenSamplers(1)
+            GL.glSamplerParameterf(sampler.glid, GL.GL_TEXTURE_LOD_BIAS, MIP_BIAS)
+            GL.glSamplerParameteri(sampler.glid, GL.GL_TEXTURE_WRAP_S, wrap_mode)
+            GL.glSamplerParameteri(sampler.glid, GL.GL_TEXTURE_WRAP_T, wrap_mode)
+            GL.glSamplerParameteri(sampler.glid, GL.GL_TEXTURE_MIN_FILTER, min_filter)
+            GL.glSamplerParameteri(sampler.glid, GL.GL_TEXTURE_MAG_FILTER, mag_filter)
+            cls.samplers[key] = sampler
+        return sampler
+
+    def __del__(self):  # delete GL sampler when no texture uses it anymore
+        GL.glDeleteSamplers(1, [self.glid])
+
+
+class Texture:
+    """ Helper class to create and automatically destroy textures. Textures of
+    the same file, parameters and type are shared, and their GL image lives
+    as long as some Texture uses it """
+
+    textures = weakref.WeakValueDictionary()  # live textures by file and params
+
+    def __new__(cls, tex_file, wrap_mode=GL.GL_REPEAT,
+                mag_filter=GL.GL_LINEAR, min_filter=GL.GL_LINEAR_MIPMAP_LINEAR,
+                tex_type=GL.GL_TEXTURE_2D):
+        key = (os.path.abspath(tex_file), int(wrap_mode), int(mag_filter),
+               int(min_filter), int(tex_type))
+        texture = cls.textures.get(key)
+        if texture is None:
+            texture = super().__new__(cls)
+            texture.image = TextureImage(tex_file, tex_type)
+            texture.sampler = Sampler(wrap_mode, mag_filter, min_filter)
+            texture.glid, texture.type = texture.image.glid, tex_type
+            cls.textures[key] = texture
+        return texture
+
+
 class TextureCubeMap:
     """ Helper class to create and automatically a texture cube map for the skybox"""
 
+    sampler = None  # sampled with its own texture parameters
+
     def __init__(self, faces):
         self.glid = GL.glGenTextures(1)
         self.type = GL.GL_TEXTURE_CUBE_MAP
 
         GL.glBindTexture(self.type, self.glid)
 
+        # faces decode together, uploads stay in order
+        prefetch(faces, 'RGB', mipmaps=False)
+        self.full_bytes = self.nbytes = 0
+        _uploads.add(self)
         for i in range(len(faces)):
             try:
-                tex = Image.open(faces[i]).convert('RGB')
-                if tex:
+                _, _, (tex,) = decoded(faces[i], 'RGB', False)
+                self.full_bytes += tex.nbytes
+                if max(tex.shape[:2]) > (max_size(faces[i]) or max(tex.shape[:2])):
+                    # budget: halve the face until it fits
+                    levels = mip_chain(tex)
+                    sizes = [level.shape[1::-1] for level in levels]
+                    tex = levels[within_budget(sizes, faces[i])]
+                height, width = tex.shape[:2]
+                self.nbytes += tex.nbytes
+                if tex.size:
                     GL.glTexImage2D(GL.GL_TEXTURE_CUBE_MAP_POSITIVE_X + i,
-                                    0, GL.GL_RGB, tex.width, tex.height, 0, GL.GL_RGB, GL.GL_UNSIGNED_BYTE, tex.tobytes())
+                                    0, GL.GL_RGB, width, height, 0, GL.GL_RGB, GL.GL_UNSIGNED_BYTE, tex)
                 else:
                     print("Cubemap tex failed to load at path:", faces[i])
 
@@ -64,7 +223,7 @@ class TextureCubeMap:
                     self.type, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
                 GL.glTexParameteri(
                     self.type, GL.GL_TEXTURE_WRAP_R, GL.GL_CLAMP_TO_EDGE)
-                print(f'Loaded texture {faces[i]} ({tex.width}x{tex.height})')
+                print(f'Loaded texture {faces[i]} ({width}x{height})')
             except FileNotFoundError:
                 print("ERROR: unable to load texture file %s" % faces[i])
 
@@ -73,6 +232,53 @@ class TextureCubeMap:
     def __del__(self):  # delete GL texture from GPU when object dies
         GL.glDeleteTextures(self.glid)
 
+class FloatTexture:
+    """ Helper class for float data textures, e.g. heightmaps (one channel per
+    texel) or normal maps (three), given as arrays indexed [x, y] """
+
+    FORMATS = {1: (GL.GL_R32F, GL.GL_RED), 3: (GL.GL_RGB32F, GL.GL_RGB)}
+    sampler = None  # sampled with its own texture parameters
+
+    def __init__(self, data):
+        self.glid = GL.glGenTextures(1)
+        self.type = GL.GL_TEXTURE_2D
+        self.shape = None
+        self.upload(data)
+
+    @staticmethod
+    def _texels(data):
+        """Rows along y as GL expects them, one channel axis, float32"""
+        data = np.asarray(data, np.float32)
+        data = data[..., None] if data.ndim == 2 else data
+        return np.ascontiguousarray(np.swapaxes(data, 0, 1))
+
+    def upload(self, data):
+        """(Re)allocate the texture from a whole array, size may change"""
+        texels = self._texels(data)
+        internal, channels = self.FORMATS[texels.shape[2]]
+        self.shape = texels.shape
+        GL.glBindTexture(self.type, self.glid)
+        GL.glTexImage2D(self.type, 0, internal, texels.shape[1], texels.shape[0],
+                        0, channels, GL.GL_FLOAT, texels)
+        GL.glTexParameteri(self.type, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(self.type, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(self.type, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
+        GL.glTexParameteri(self.type, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
+        GL.glBindTexture(self.type, 0)
+
+    def update(self, data, x=0, y=0):
+        """Overwrite the texels of a sub region starting at (x, y)"""
+        texels = self._texels(data)
+        channels = self.FORMATS[texels.shape[2]][1]
+        GL.glBindTexture(self.type, self.glid)
+        GL.glTexSubImage2D(self.type, 0, x, y, texels.shape[1], texels.shape[0],
+                           channels, GL.GL_FLOAT, texels)
+        GL.glBindTexture(self.type, 0)
+
+    def __del__(self):  # delete GL texture from GPU when object dies
+        GL.glDeleteTextures(self.glid)
+
+
 # -------------- Textured mesh decorator --------------------------------------
 
 
@@ -89,6 +295,7 @@ class Textured:
         for index, (name, texture) in enumerate(self.textures.items()):
             GL.glActiveTexture(GL.GL_TEXTURE0 + index)
             GL.glBindTexture(texture.type, texture.glid)
+            GL.glBindSampler(index, texture.sampler.glid if texture.sampler else 0)
             uniforms[name] = index
         self.drawable.draw(primitives=primitives, **uniforms)
         if "skybox" in self.textures:
@@ -0,0 +1,162 @@
+"""
+On-disk cache of decoded texture images and their mip chains.
+Levels are stored as .npy files and memory mapped back on warm starts, so
+that textures upload without decoding nor mipmap generation. Levels can be
+stored block compressed as BC1 (opaque) or BC3 (with alpha).
+"""
+# Python built-in modules
+import hashlib  # cache keys are digests of the file identity
+import os  # file identity and cache directory
+
+# external module
+import numpy as np  # pixels, mip levels and compressed blocks
+from PIL import Image  # image decoding on cache misses
+
+from mesh_cache import ROOT, MeshCache
+
+CACHE_DIR = os.path.join(ROOT, ".cache", "textures")
+CACHE_VERSION = 2  # bump to invalidate every entry after a format change
+CACHE_MAX_BYTES = 1024 * 2**20
+
+# GL_EXT_texture_compression_s3tc internal formats
+BC1 = 0x83F0  # GL_COMPRESSED_RGB_S3TC_DXT1_EXT, 8 bytes per 4x4 block
+BC3 = 0x83F3  # GL_COMPRESSED_RGBA_S3TC_DXT5_EXT, 16 bytes per 4x4 block
+
+
+def _halve(level, axis):
+    """Level with texel pairs along axis averaged, the last texel of an odd
+    size averaged into the last pair"""
+    size = level.shape[axis]
+    if size == 1:
+        return level
+    half = size // 2
+    pairs = np.take(level, np.arange(2 * half), axis)
+    shape = pairs.shape[:axis] + (half, 2) + pairs.shape[axis + 1 :]
+    halved = pairs.reshape(shape).mean(axis=axis + 1)
+    if size % 2:
+        last = np.take(level, np.arange(size - 3, size), axis).mean(axis=axis)
+        np.moveaxis(halved, axis, 0)[-1] = last
+    return halved
+
+
+def mip_chain(pixels):
+    """Levels of a (height, width, channels) uint8 image down to 1x1, each
+    texel the average of the 2x2 texels above it, 3 wide along odd sizes"""
+    levels = [np.ascontiguousarray(pixels)]
+    level = pixels.astype(np.float32)
+    while level.shape[0] > 1 or level.shape[1] > 1:
+        level = _halve(_halve(level, 0), 1)
+        levels.append(np.rint(level).astype(np.uint8))
+    return levels
+
+
+def _blocks(pixels):
+    """4x4 texel blocks of an image, edges repeated to whole blocks, as an
+    array (block rows, block columns, 16 texels, channels)"""
+    height, width = pixels.shape[:2]
+    rows = np.minimum(np.arange(-(-height // 4) * 4), height - 1)
+    cols = np.minimum(np.arange(-(-width // 4) * 4), width - 1)
+    padded = pixels[rows][:, cols]
+    blocks = padded.reshape(len(rows) // 4, 4, len(cols) // 4, 4, -1)
+    return blocks.swapaxes(1, 2).reshape(len(rows) // 4, len(cols) // 4, 16, -1)
+
+
+def _rgb565(colors):
+    """Packed 5:6:5 values of float RGB colors, and the colors they decode to"""
+    scale = np.array([31, 63, 31], np.float32)
+    bits = np.rint(np.clip(colors, 0, 255) * scale / 255).astype(np.uint16)
+    packed = bits[..., 0] << 11 | bits[..., 1] << 5 | bits[..., 2]
+    return packed, bits * (255 / scale)
+
+
+def _indices(values, palette, bits):
+    """Per texel index of the closest palette entry, packed in one integer"""
+    distance = ((values[..., None, :] - palette[..., None, :, :]) ** 2).sum(-1)
+    index = distance.argmin(axis=-1).astype(np.uint64)
+    shifts = np.arange(16, dtype=np.uint64) * np.uint64(bits)
+    return np.bitwise_or.reduce(index << shifts, axis=-1)
+
+
+def _color_blocks(blocks):
+    """BC1 four colors blocks of (..., 16, 3) texels: endpoints at the bounding
+    box corners, texels at the closest of four interpolated colors"""
+    high, low = blocks.max(axis=-2), blocks.min(axis=-2)
+    (c0, rgb0), (c1, rgb1) = _rgb565(high), _rgb565(low)
+    # four color mode needs c0 > c1, swap endpoints otherwise
+    swap = c0 < c1
+    c0, c1 = np.where(swap, c1, c0), np.where(swap, c0, c1)
+    swap = swap[..., None]
+    rgb0, rgb1 = np.where(swap, rgb1, rgb0), np.where(swap, rgb0, rgb1)
+    palette = np.stack((rgb0, rgb1, (2 * rgb0 + rgb1) / 3, (rgb0 + 2 * rgb1) / 3), -2)
+    indices = np.where(c0 == c1, 0, _indices(blocks, palette, 2))
+    data = np.zeros(c0.shape + (8,), np.uint8)
+    data[..., 0:2] = c0.astype("<u2")[..., None].view(np.uint8)
+    data[..., 2:4] = c1.astype("<u2")[..., None].view(np.uint8)
+    data[..., 4:8] = indices.astype("<u4")[..., None].view(np.uint8)
+    return data
+
+
+def _alpha_blocks(alpha):
+    """BC3 alpha blocks of (..., 16) alphas: eight interpolated values between
+    the block extremes, 3 bits per texel"""
+    a0, a1 = alpha.max(axis=-1), alpha.min(axis=-1)
+    w0 = np.array([7, 0, 6, 5, 4, 3, 2, 1], np.float32)
+    palette = (w0 * a0[..., None] + (7 - w0) * a1[..., None]) / 7
+    indices = np.where(a0 == a1, 0, _indices(alpha[..., None], palette[..., None], 3))
+    data = np.zeros(a0.shape + (8,), np.uint8)
+    data[..., 0], data[..., 1] = a0, a1
+    data[..., 2:8] = indices.astype("<u8")[..., None].view(np.uint8)[..., :6]
+    return data
+
+
+def compress(pixels, gl_format, rows=64):
+    """RGBA image as a flat uint8 array of BC1 or BC3 blocks, encoded rows
+    block rows at a time to bound memory use"""
+    blocks, encoded = _blocks(pixels), []
+    for start in range(0, len(blocks), rows):
+        band = blocks[start : start + rows].astype(np.float32)
+        colors = _color_blocks(band[..., :3])
+        if gl_format == BC3:
+            colors = np.concatenate((_alpha_blocks(band[..., 3]), colors), axis=-1)
+        encoded.append(colors.ravel())
+    return np.concatenate(encoded)
+
+
+class TextureCache(MeshCache):
+    """Memory mapped mip chains, keyed by image file path, modification time
+    and size, pixel mode and compression"""
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        super().__init__(directory, max_bytes)
+
+    def key(self, name, params, build=None):
+        """Hash of the file identity, parameters and cache version"""
+        digest = hashlib.sha1(f"{name}:{CACHE_VERSION}:{params!r}".encode())
+        return f"{os.path.basename(name)}-{digest.hexdigest()[:16]}"
+
+    def get_levels(self, tex_file, mode="RGBA", mipmaps=True, compressed=False):
+        """(GL internal format or None, [(width, height)], [level arrays]) of
+        an image file, decoded and mipmapped on cache misses only. Only RGBA
+        images can be compressed."""
+        stat = os.stat(tex_file)
+        compressed = compressed and mode == "RGBA"
+        params = (mode, mipmaps, compressed, stat.st_mtime_ns, stat.st_size)
+
+        def build():
+            pixels = np.asarray(Image.open(tex_file).convert(mode))
+            levels = mip_chain(pixels) if mipmaps else [pixels]
+            sizes = [(level.shape[1], level.shape[0]) for level in levels]
+            gl_format = 0
+            if compressed:  # BC1 for opaque images, BC3 with alpha
+                gl_format = BC1 if (pixels[..., 3] == 255).all() else BC3
+                levels = [compress(level, gl_format) for level in levels]
+            arrays = {f"level{i}": level for i, level in enumerate(levels)}
+            return dict(arrays, sizes=np.array(sizes), format=np.array([gl_format]))
+
+        arrays = self.get(os.path.abspath(tex_file), params, build)
+        sizes = [tuple(int(v) for v in size) for size in arrays["sizes"]]
+        levels = [arrays[f"level{i}"] for i in range(len(sizes))]
+        return int(arrays["format"][0]) or None, sizes, levels
+
+
+texture_cache = TextureCache()
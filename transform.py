@@ -10,52 +10,92 @@ from numbers import Number  # useful to check type of arg: scalar or vector?
 
 # external module
 import numpy as np  # matrices, vectors & quaternions are numpy arrays
-from perlin_noise import PerlinNoise
+
+from noise import GradientNoise
+from parallel import evaluate
 
 # Useful home made functions --------------------------------------------------
 
 
-def compute_normals(base_coords, indices):
-    """Compute the normals of each vertex of base_coords with the given indices"""
-    normals = [[0, 0, 0] for _ in range(len(base_coords))]
-    if isinstance(indices[0], int) or isinstance(indices[0], np.uint32):
-        indices = np.array_split(indices, len(indices) / 3)
-    for a, b, c in indices:
-        v1 = np.subtract(base_coords[b], base_coords[a])
-        v2 = np.subtract(base_coords[c], base_coords[b])
-        for i in (a, b, c):
-            normals[i] = normalized(normals[i] + np.cross(v1, v2))
-    return np.array(normals, np.float32)
+def compute_normals(base_coords, indices, weighting="area"):
+    """Compute the normals of each vertex of base_coords with the given indices.
+    Face normals are weighted by triangle 'area', corner 'angle' or 'uniform'"""
+    coords = np.asarray(base_coords, np.float64)
+    triangles = np.asarray(indices, np.int64).reshape(-1, 3)
+    corners = coords[triangles]  # (n, 3 corners, xyz)
+    edges = np.roll(corners, -1, axis=1) - corners  # a->b, b->c, c->a
+    faces = np.cross(edges[:, 0], edges[:, 1])  # length is twice the area
+
+    if weighting == "area":
+        weights = np.repeat(faces[:, None], 3, axis=1)
+    elif weighting == "uniform":
+        lengths = np.linalg.norm(faces, axis=1, keepdims=True)
+        unit = np.divide(faces, lengths, out=np.zeros_like(faces), where=lengths > 0)
+        weights = np.repeat(unit[:, None], 3, axis=1)
+    elif weighting == "angle":
+        lengths = np.linalg.norm(faces, axis=1, keepdims=True)
+        unit = np.divide(faces, lengths, out=np.zeros_like(faces), where=lengths > 0)
+        incoming = -np.roll(edges, 1, axis=1)  # corner -> previous corner
+        angles = np.arctan2(
+            np.linalg.norm(np.cross(edges, incoming), axis=2),
+            np.sum(edges * incoming, axis=2),
+        )
+        weights = unit[:, None] * angles[..., None]
+    else:
+        raise ValueError("unknown normal weighting %s" % weighting)
+
+    # scatter-add every corner contribution to its vertex, normalize once
+    flat = triangles.ravel()
+    weights = weights.reshape(-1, 3)
+    normals = np.column_stack(
+        [np.bincount(flat, weights[:, k], minlength=len(coords)) for k in range(3)]
+    )
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    normals = np.divide(normals, lengths, out=normals, where=lengths > 0)
+    return normals.astype(np.float32)
+
 
+def compact_index_type(vertex_count):
+    """Smallest unsigned index type able to address vertex_count vertices"""
+    return np.uint16 if vertex_count <= 2**16 else np.uint32
 
-def create_grid(size, noise=False, height_offset=0, formula=None):
-    """Create grid for terrain generation"""
-    positions = []
-    indices = []
+
+def grid_triangles(rows, cols):
+    """Triangle indices of a row-major rows x cols vertex grid, two per quad"""
+    index = np.arange(rows * cols).reshape(rows, cols)
+    low_left, low_right = index[:-1, :-1], index[:-1, 1:]
+    up_left, up_right = index[1:, :-1], index[1:, 1:]
+    triangles = np.stack(
+        (up_left, low_right, low_left, up_left, up_right, low_right), axis=-1
+    )
+    return triangles.reshape(-1, 3).astype(compact_index_type(rows * cols))
+
+
+def create_grid(
+    size, noise=False, height_offset=0, formula=None, spacing=1, seed=None, workers=1
+):
+    """Create grid for terrain generation over [-size, size]^2 with one vertex
+    every 'spacing' units, formula(x, y) is evaluated on whole arrays.
+    Heights are evaluated by row bands over workers processes if more than
+    one, formula must then be picklable."""
+    coords = np.linspace(-size, size, round(2 * size / spacing) + 1)
+    rows, cols = np.meshgrid(coords, coords, indexing="ij")
     if noise:
-        noise = PerlinNoise(10)
-
-    for i in range(-size, size + 1):
-        for j in range(-size, size + 1):
-            if noise:
-                height = (
-                    5 * noise([(i + size) / (2 * size), (j + size) / (2 * size)])
-                    + height_offset
-                )
-            elif formula:
-                height = formula(i, j)
-            else:
-                height = height_offset
-            positions.append((i, j, height))
-            current = (i + size) * (2 * size + 1) + j + size
-            if i > -size and j == -size:
-                indices.append((current - (2 * size + 1), current, current - 2 * size))
-            elif i > -size and j == size:
-                indices.append((current, current - (2 * size + 1), current - 1))
-            elif i > -size:
-                indices.append((current - 1, current, current - (2 * size + 1)))
-                indices.append((current, current - 2 * size, current - (2 * size + 1)))
-    return (np.array(positions), np.array(indices))
+        noise = GradientNoise(10, seed)
+        heights = (
+            5
+            * evaluate(
+                noise, (rows + size) / (2 * size), (cols + size) / (2 * size), workers
+            )
+            + height_offset
+        )
+    elif formula:
+        heights = evaluate(formula, rows, cols, workers)
+    else:
+        heights = np.full(rows.shape, height_offset, np.float64)
+
+    positions = np.stack((rows, cols, heights), axis=-1).reshape(-1, 3)
+    return positions, grid_triangles(len(coords), len(coords))
 
 
 # Some useful functions on vectors -------------------------------------------
@@ -0,0 +1,83 @@
+"""
+Compact vertex attribute formats.
+Attributes are stored on the GPU as half floats, packed normals, normalized
+bytes or integers instead of 32 bits floats, and converted back by the GPU.
+"""
+# external module
+import numpy as np  # attribute arrays
+import OpenGL.GL as GL  # standard Python OpenGL wrapper
+
+
+def _packed_normal(data):
+    """Unit vectors as signed normalized 10 bits x, y, z in one int32"""
+    values = np.clip(np.rint(np.asarray(data, np.float64)[:, :3] * 511), -511, 511)
+    bits = values.astype(np.int64) & 0x3FF
+    packed = bits[:, 0] | bits[:, 1] << 10 | bits[:, 2] << 20
+    return packed.astype(np.uint32).view(np.int32).reshape(-1, 1)
+
+
+def _padded(dtype, scale=1):
+    """Conversion to dtype, components padded so that rows are 4 bytes aligned"""
+
+    def convert(data):
+        data = np.asarray(data, np.float64) * scale
+        data = data.reshape(len(data), -1)
+        count = -(-data.shape[1] * np.dtype(dtype).itemsize // 4) * 4
+        count //= np.dtype(dtype).itemsize
+        padded = np.zeros((len(data), count), dtype)
+        if np.issubdtype(dtype, np.integer):
+            info = np.iinfo(dtype)
+            data = np.clip(np.rint(data), info.min, info.max)
+        padded[:, : data.shape[1]] = data
+        return padded
+
+    return convert
+
+
+class VertexFormat:
+    """GPU storage of one vertex attribute: conversion of the float data to
+    the stored array, GL component type, normalization, integer attribute"""
+
+    def __init__(self, convert, gl_type, normalized=False, integer=False, size=None):
+        self.convert = convert
+        self.gl_type = gl_type
+        self.normalized = normalized
+        self.integer = integer
+        self.size = size  # GL component count, that of the stored rows if None
+
+    def pack(self, data):
+        """Stored array and GL component count of the attribute data"""
+        packed = self.convert(data)
+        return packed, self.size or packed.shape[1]
+
+
+FORMATS = dict(
+    float=VertexFormat(_padded(np.float32), GL.GL_FLOAT),
+    half=VertexFormat(_padded(np.float16), GL.GL_HALF_FLOAT),
+    normal=VertexFormat(_packed_normal, GL.GL_INT_2_10_10_10_REV, True, size=4),
+    unorm8=VertexFormat(_padded(np.uint8, 255), GL.GL_UNSIGNED_BYTE, True),
+    uint8=VertexFormat(_padded(np.uint8), GL.GL_UNSIGNED_BYTE, integer=True),
+    int32=VertexFormat(_padded(np.int32), GL.GL_INT, integer=True),
+)
+
+# compact formats for the attribute names used across the project
+COMPACT = dict(
+    normal="normal",
+    tex_coord="half",
+    color="unorm8",
+    bone_weights="unorm8",
+    bone_ids="uint8",
+)
+
+
+def vertex_format(name):
+    """Format object for a format name, or the format itself"""
+    return FORMATS[name] if isinstance(name, str) else name
+
+
+def report(attributes, packed):
+    """Print the bytes saved by compact formats against 32 bits floats"""
+    before = sum(np.asarray(data, np.float32).nbytes for data in attributes.values())
+    after = sum(data.nbytes for data in packed.values())
+    saved = 100 * (before - after) / before if before else 0
+    print(f"Vertex formats: {before} -> {after} bytes ({saved:.0f}% saved)")
@@ -2,20 +2,63 @@
 
 """ Main file """
 
+import numpy as np
+
 from arbre import AnimatedTree
 from assets.Skybox.skybox import Skybox
 from assets.Volcano.volcano import Volcano
 from assets.Water.water import Water
-from core import Node, Shader, Viewer
+from core import Node, Shader, Viewer, finish_all
 from disk import Disk
 from floor import Floor
+from heights import plains_height
+from heightfield import highest
+from terrain import ChunkedTerrain, StreamingTerrain
+import texture
+from texture import Texture, Textured, prefetch
 from transform import scale, translate
 
 #from smoke import Smoke, SmokeParticle
 
+# displace the Floor and Volcano heightfields on the GPU from heightmaps
+HEIGHTMAPS = False
+# stream endless plains around the camera, beyond the island
+STREAMING = False
+# or draw plains 50 times wider than the island, with distance based LOD
+CHUNKED = False
+
+# every texture of the scene, decoded in parallel while the scene is built
+TEXTURES = [
+    "img/grass.png",
+    "img/basalte.jpg",
+    "img/rock.png",
+    "img/terre.jpeg",
+    "img/lava.jpg",
+    "img/water.jpg",
+    "arbre/leaf.jpg",
+    "arbre/wood.png",
+]
+SKYBOX = [
+    "img/cubemaps/right.png",
+    "img/cubemaps/left.png",
+    "img/cubemaps/top.png",
+    "img/cubemaps/bottom.png",
+    "img/cubemaps/front.png",
+    "img/cubemaps/back.png",
+]
+
+
+# texture budget: largest texture side, None for full resolution, e.g. 1024
+# on low memory machines. Leaves are tiny on screen, water is a far plane.
+texture.MAX_SIZE = None
+texture.SIZE_OVERRIDES.update({"arbre/leaf.jpg": 512, "img/water.jpg": 2048})
+
+
 def main():
     """create a window, add scene objects, then run rendering loop"""
     viewer = Viewer()
+    prefetch(TEXTURES)
+    prefetch(SKYBOX, "RGB", mipmaps=False)
 
     floor_shader = Shader("floor.vert", "floor.frag")
     lava_shader = Shader("lava.vert", "lava.frag")
@@ -30,60 +73,80 @@ def main():
     volcano_shader = Shader(
         "assets/Volcano/shaders/volcano.vert", "assets/Volcano/shaders/volcano.frag"
     )
+    floor_heightmap_shader = volcano_heightmap_shader = None
+    if HEIGHTMAPS:
+        floor_heightmap_shader = Shader("floor_heightmap.vert", "floor.frag")
+        volcano_heightmap_shader = Shader(
+            "assets/Volcano/shaders/volcano_heightmap.vert",
+            "assets/Volcano/shaders/volcano.frag",
+        )
+    # shared with every tree, created here to compile with the others
+    tree_shader = Shader("tree.vert", "tree.frag")
+    finish_all()  # programs compiled side by side, checked before any mesh
 
     viewer.add(
-        Skybox(
-            skybox_shader,
-            [
-                "img/cubemaps/right.png",
-                "img/cubemaps/left.png",
-                "img/cubemaps/top.png",
-                "img/cubemaps/bottom.png",
-                "img/cubemaps/front.png",
-                "img/cubemaps/back.png",
-            ],
-        )
+        Skybox(skybox_shader, SKYBOX)
     )
 
-    ##### Some trees #####
+    lava = Node(children=[Disk(lava_shader, "img/lava.jpg", 20, 150)])
+    mountain = Volcano(
+        volcano_shader,
+        "img/grass.png",
+        "img/basalte.jpg",
+        heightmap_shader=volcano_heightmap_shader,
+    )
+    volcano = Node(children=[mountain, lava])
+    ground = Floor(
+        floor_shader,
+        "img/rock.png",
+        "img/terre.jpeg",
+        "img/grass.png",
+        heightmap_shader=floor_heightmap_shader,
+    )
+
+    ##### Some trees, standing on the floor or the volcano #####
+    fields = (ground.heightfield, mountain.heightfield)
+    spots = [(-200 + 150 * i, ((-1) ** i) * (-200 + 130 * i)) for i in range(4)]
+    spots2 = [(200 - 120 * i, ((-1) ** i) * (200 - 50 * i)) for i in range(4)]
+    heights = highest(fields, *np.transpose(spots + spots2))
     trees = Node(
         children=[
-            AnimatedTree(
-                transform=translate(
-                    (-200 + 150 * i, ((-1) ** i) * (-200 + 130 * i), 10))
-                @ scale((0.8, 0.8, 0.8))
-            )
-            for i in range(4)
+            AnimatedTree(transform=translate((x, y, z)) @ scale((0.8, 0.8, 0.8)))
+            for (x, y), z in zip(spots, heights[:4])
         ]
     )
     trees2 = Node(
         children=[
-            AnimatedTree(
-                transform=translate((200 - 120 * i, ((-1) ** i) * (200 - 50 * i), 10))
-                @ scale((0.8, 0.8, 0.8))
-            )
-            for i in range(4)
+            AnimatedTree(transform=translate((x, y, z)) @ scale((0.8, 0.8, 0.8)))
+            for (x, y), z in zip(spots2, heights[4:])
         ]
     )
 
-    lava = Node(children=[Disk(lava_shader, "img/lava.jpg", 20, 150)])
-    volcano = Node(
-        children=[Volcano(volcano_shader, "img/grass.png", "img/basalte.jpg"), lava]
-    )
-
-    floor = Node(
-        children=[
-            Floor(floor_shader, "img/rock.png", "img/terre.jpeg", "img/grass.png"),
-            volcano
-        ]
-    )
+    floor = Node(children=[ground, volcano])
 
     island = Node(children=[floor, trees, trees2])
     viewer.add(island)
     viewer.add(Water(water_shader))
+    plains = None
+    if STREAMING:
+        plains = StreamingTerrain(floor_shader, plains_height, 400, tex_period=100)
+    elif CHUNKED:
+        plains = ChunkedTerrain(
+            floor_shader, plains_height, 18000, max_depth=7, tex_period=100
+        )
+    if plains is not None:
+        viewer.add(
+            Textured(
+                plains,
+                tex=Texture("img/rock.png"),
+                tex2=Texture("img/terre.jpeg"),
+                tex3=Texture("img/grass.png"),
+            )
+        )
 
     # smoke = Smoke()
     # viewer.add(smoke)
+    texture.memory_report()
 
     print("\n############## CONTROLS ##############")
     print("- ZQSD: Touche directionnelles")
@@ -100,6 +163,8 @@ def main():
 
     # start rendering loop
     viewer.run()
+    if plains is not None:
+        plains.close()  # stop its chunk workers
 
 
 if __name__ == "__main__":